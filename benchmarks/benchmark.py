@@ -0,0 +1,236 @@
+'''
+difPy - Python package for finding duplicate and similar images.
+2024 Elise Landman
+https://github.com/elisemercury/Duplicate-Image-Finder
+
+Benchmark suite for difPy. Generates a reproducible synthetic image dataset and
+times every phase of difPy.build and difPy.search across a grid of settings.
+'''
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+from datetime import datetime
+from multiprocessing import freeze_support
+from time import perf_counter
+import numpy as np
+from PIL import Image
+
+# benchmark the difPy version of this repository
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import difPy
+from difPy import dif
+
+class generate_dataset:
+    '''
+    A class used to generate a synthetic image dataset
+    '''
+    def __init__(self, directory, images=500, resolutions=((640, 480), (1024, 768), (800, 800)), formats=('png', 'jpg'), duplicate_ratio=0.2, near_duplicate_ratio=0.1, noise=2.0, folders=1, seed=0):
+        '''
+        Parameters
+        ----------
+        directory : str
+            Path of the directory the dataset is written to
+        images : int (optional)
+            Total number of images in the dataset (default is 500)
+        resolutions : list (optional)
+            (width, height) resolutions the images are generated with (default is 640x480, 1024x768, 800x800)
+        formats : list (optional)
+            File formats the images are saved as (default is 'png', 'jpg')
+        duplicate_ratio : float (optional)
+            Share of images that are exact copies of another image (default is 0.2)
+        near_duplicate_ratio : float (optional)
+            Share of images that are noisy copies of another image (default is 0.1)
+        noise : float (optional)
+            Standard deviation of the pixel noise added to near duplicates (default is 2.0)
+        folders : int (optional)
+            Number of sub-folders the images are distributed across (default is 1)
+        seed : int (optional)
+            Seed of the random number generator (default is 0)
+        '''
+        self.directory = directory
+        self.__rng = np.random.default_rng(seed)
+        self.__resolutions = resolutions
+        self.__formats = formats
+        self.__folders = folders
+        self.files = []
+
+        n_duplicates = int(images * duplicate_ratio)
+        n_near_duplicates = int(images * near_duplicate_ratio)
+        n_originals = max(images - n_duplicates - n_near_duplicates, 1)
+
+        originals = [self._save(self._random_image()) for i in range(n_originals)]
+        for i in range(n_duplicates):
+            # exact copy of an original, in the same file format
+            src = originals[self.__rng.integers(len(originals))]
+            dst = self._new_filename(src.split('.')[-1])
+            shutil.copyfile(src, dst)
+            self.files.append(dst)
+        for i in range(n_near_duplicates):
+            # noisy copy of an original, re-encoded in a random file format
+            src = originals[self.__rng.integers(len(originals))]
+            with Image.open(src) as img:
+                array = np.asarray(img.convert('RGB'), dtype=float)
+            array = array + self.__rng.normal(0, noise, array.shape)
+            self._save(np.clip(array, 0, 255).astype(np.uint8))
+        return
+
+    def _random_image(self):
+        # Function that generates a smooth random image by upscaling low resolution noise
+        width, height = self.__resolutions[self.__rng.integers(len(self.__resolutions))]
+        small = self.__rng.integers(0, 256, (max(height // 32, 2), max(width // 32, 2), 3), dtype=np.uint8)
+        return np.asarray(Image.fromarray(small).resize((width, height), resample=Image.BICUBIC))
+
+    def _new_filename(self, ext):
+        # Function that returns the filename of the next image
+        folder = os.path.join(self.directory, f'folder_{len(self.files) % self.__folders}')
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, f'img_{len(self.files)}.{ext}')
+
+    def _save(self, array):
+        # Function that saves an image array in a random file format
+        filename = self._new_filename(self.__formats[self.__rng.integers(len(self.__formats))])
+        Image.fromarray(array).save(filename)
+        self.files.append(filename)
+        return filename
+
+class _phase_timer:
+    '''
+    A class that times the phases of difPy.build and difPy.search by wrapping their methods
+    '''
+    phases = {
+        'discovery' : (dif.build, '_get_files'),
+        'decode' : (dif.build, '_build_image_dictionaries'),
+        'search_union' : (dif.search, '_search_union'),
+        'search_infolder' : (dif.search, '_search_infolder'),
+        'grouping_union' : (dif.search, '_group_result_union'),
+        'grouping_infolder' : (dif.search, '_group_result_infolder'),
+        'ranking_union' : (dif.search, '_search_metadata_union'),
+        'ranking_infolder' : (dif.search, '_search_metadata_infolder'),
+    }
+
+    def __init__(self):
+        self.seconds = dict()
+        self.__originals = dict()
+
+    def __enter__(self):
+        for phase, (cls, name) in self.phases.items():
+            original = getattr(cls, name)
+            self.__originals[phase] = original
+            setattr(cls, name, self._wrap(phase, original))
+        return self
+
+    def __exit__(self, *args):
+        for phase, (cls, name) in self.phases.items():
+            setattr(cls, name, self.__originals[phase])
+
+    def _wrap(self, phase, function):
+        # Function that wraps a method to accumulate its duration
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.seconds[phase] = self.seconds.get(phase, 0) + perf_counter() - start
+        return wrapper
+
+def _run(directory, in_folder, px_size, processes, similarities, rotate, same_dim):
+    # Function that runs one build and its searches, and returns their timings
+    records = []
+    with _phase_timer() as timer:
+        start = perf_counter()
+        dif_obj = difPy.build(directory, in_folder=in_folder, px_size=px_size, processes=processes, show_progress=False)
+        build_seconds = perf_counter() - start
+    build_phases = {phase : round(seconds, 4) for phase, seconds in timer.seconds.items()}
+
+    for similarity in similarities:
+        with _phase_timer() as timer:
+            start = perf_counter()
+            se = difPy.search(dif_obj, similarity=similarity, rotate=rotate, same_dim=same_dim, processes=processes, show_progress=False)
+            search_seconds = perf_counter() - start
+        records.append({
+            'parameters' : {'in_folder' : in_folder, 'px_size' : px_size, 'processes' : processes, 'similarity' : similarity, 'rotate' : rotate, 'same_dim' : same_dim},
+            'files' : len(dif_obj._filename_dictionary),
+            'build' : {'seconds' : round(build_seconds, 4), 'phases' : build_phases},
+            'search' : {'seconds' : round(search_seconds, 4), 'phases' : {phase : round(seconds, 4) for phase, seconds in timer.seconds.items()}},
+            'matches_found' : se.stats['process']['search']['matches_found'],
+            'lower_quality' : len(se.lower_quality),
+        })
+    return records
+
+def _environment():
+    # Function that describes the environment the benchmark runs in
+    return {
+        'difpy' : difPy.__version__,
+        'python' : platform.python_version(),
+        'numpy' : np.__version__,
+        'pillow' : Image.__version__,
+        'platform' : platform.platform(),
+        'cpu_count' : os.cpu_count(),
+    }
+
+def _parse_list(type):
+    # Function to make the CLI accept comma separated lists
+    return lambda x: [type(i) for i in x.split(',')]
+
+def _parse_resolutions(x):
+    # Function to make the CLI accept comma separated WIDTHxHEIGHT resolutions
+    return [tuple(int(i) for i in res.lower().split('x')) for res in x.split(',')]
+
+if __name__ == '__main__':
+    freeze_support()
+    parser = argparse.ArgumentParser(description='Benchmark difPy on a synthetic image dataset - https://github.com/elisemercury/Duplicate-Image-Finder')
+    parser.add_argument('-n', '--images', type=int, help='Number of images in the synthetic dataset.', required=False, default=500)
+    parser.add_argument('-res', '--resolutions', type=_parse_resolutions, help='Comma separated image resolutions, f. e. 640x480,1024x768.', required=False, default=[(640, 480), (1024, 768), (800, 800)])
+    parser.add_argument('-fmt', '--formats', type=_parse_list(str), help='Comma separated image file formats, f. e. png,jpg,webp.', required=False, default=['png', 'jpg'])
+    parser.add_argument('-dr', '--duplicate_ratio', type=float, help='Share of exact duplicate images.', required=False, default=0.2)
+    parser.add_argument('-ndr', '--near_duplicate_ratio', type=float, help='Share of near duplicate images.', required=False, default=0.1)
+    parser.add_argument('-no', '--noise', type=float, help='Standard deviation of the pixel noise of near duplicates.', required=False, default=2.0)
+    parser.add_argument('-fo', '--folders', type=int, help='Number of sub-folders of the dataset.', required=False, default=1)
+    parser.add_argument('-seed', '--seed', type=int, help='Seed of the dataset generator.', required=False, default=0)
+    parser.add_argument('-D', '--directory', type=str, help='Directory of the dataset. If it already exists, it is reused instead of generated. Default is a temporary directory.', required=False, default=None)
+    parser.add_argument('-px', '--px_size', type=_parse_list(int), help='Comma separated px_size values.', required=False, default=[50])
+    parser.add_argument('-proc', '--processes', type=_parse_list(int), help='Comma separated processes values.', required=False, default=[os.cpu_count()])
+    parser.add_argument('-s', '--similarity', type=_parse_list(dif._help._convert_str_to_int), help='Comma separated similarity values.', required=False, default=['duplicates', 'similar'])
+    parser.add_argument('-i', '--in_folder', type=lambda x: bool(dif._help._strtobool(x)), help='Search for matches in each sub-folder separately.', required=False, choices=[True, False], default=False)
+    parser.add_argument('-ro', '--rotate', type=lambda x: bool(dif._help._strtobool(x)), help='Rotate images during comparison process.', required=False, choices=[True, False], default=True)
+    parser.add_argument('-dim', '--same_dim', type=lambda x: bool(dif._help._strtobool(x)), help='Only compare image having the same dimensions (width x height)', required=False, choices=[True, False], default=True)
+    parser.add_argument('-rep', '--repeat', type=int, help='Number of times every setting is run.', required=False, default=1)
+    parser.add_argument('-o', '--output', type=str, help='Path of the JSON result file. Default is stdout.', required=False, default=None)
+
+    args = parser.parse_args()
+
+    temp_dir = None
+    if args.directory is not None and os.path.isdir(args.directory):
+        directory = args.directory
+        dataset = {'directory' : directory, 'generated' : False}
+    else:
+        if args.directory is None:
+            temp_dir = tempfile.mkdtemp(prefix='difPy_benchmark_')
+        directory = args.directory or temp_dir
+        start = perf_counter()
+        generate_dataset(directory, images=args.images, resolutions=args.resolutions, formats=args.formats, duplicate_ratio=args.duplicate_ratio, near_duplicate_ratio=args.near_duplicate_ratio, noise=args.noise, folders=args.folders, seed=args.seed)
+        dataset = {'directory' : directory, 'generated' : True, 'seconds' : round(perf_counter() - start, 4),
+                   'images' : args.images, 'resolutions' : args.resolutions, 'formats' : args.formats, 'duplicate_ratio' : args.duplicate_ratio,
+                   'near_duplicate_ratio' : args.near_duplicate_ratio, 'noise' : args.noise, 'folders' : args.folders, 'seed' : args.seed}
+
+    runs = []
+    try:
+        for px_size in args.px_size:
+            for processes in args.processes:
+                for repeat in range(args.repeat):
+                    print(f'difPy benchmark: px_size={px_size} processes={processes} run {repeat+1}/{args.repeat}', file=sys.stderr)
+                    runs += _run(directory, args.in_folder, px_size, processes, args.similarity, args.rotate, args.same_dim)
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    output = {'timestamp' : datetime.now().isoformat(), 'environment' : _environment(), 'dataset' : dataset, 'runs' : runs}
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(output, file, indent=2, default=str)
+    else:
+        print(json.dumps(output, indent=2, default=str))
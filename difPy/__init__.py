@@ -1,2 +1,2 @@
 from .version import __version__
-from .dif import build, search
\ No newline at end of file
+from .dif import build, search, serve, plan, query, build_async, search_async
\ No newline at end of file
@@ -0,0 +1,32 @@
+'''
+difPy - Python package for finding duplicate and similar images.
+2024 Elise Landman
+https://github.com/elisemercury/Duplicate-Image-Finder
+'''
+import argparse
+import os
+from .dif import build, serve, _help
+
+if __name__ == '__main__':
+    # Parameters for when launching the difPy server via CLI
+    parser = argparse.ArgumentParser(prog='python -m difPy', description='Find duplicate or similar images with difPy - https://github.com/elisemercury/Duplicate-Image-Finder')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve_parser = subparsers.add_parser('serve', help='Keep an image repository in memory and serve match queries over a local HTTP server.')
+    serve_parser.add_argument('-D', '--directory', type=str, nargs='+', help='Paths of the directories to be served. Default is working dir.', required=False, default=[os.getcwd()])
+    serve_parser.add_argument('-H', '--host', type=str, help='Host address the server binds to.', required=False, default='127.0.0.1')
+    serve_parser.add_argument('-P', '--port', type=int, help='Port the server listens on.', required=False, default=8765)
+    serve_parser.add_argument('-r', '--recursive', type=lambda x: bool(_help._strtobool(x)), help='Search recursively within the directories.', required=False, choices=[True, False], default=True)
+    serve_parser.add_argument('-le', '--limit_extensions', type=lambda x: bool(_help._strtobool(x)), help='Limit search to known image file extensions.', required=False, choices=[True, False], default=True)
+    serve_parser.add_argument('-px', '--px_size', type=int, help='Compression size of images in pixels.', required=False, default=50)
+    serve_parser.add_argument('-f', '--features', type=str, help='Color channels the image tensors are generated from.', required=False, choices=['rgb', 'gray'], default='rgb')
+    serve_parser.add_argument('-s', '--similarity', type=_help._convert_str_to_int, help='Default similarity grade (mse) of queries.', required=False, default='duplicates')
+    serve_parser.add_argument('-ro', '--rotate', type=lambda x: bool(_help._strtobool(x)), help='Rotate images during comparison process.', required=False, choices=[True, False], default=True)
+    serve_parser.add_argument('-dim', '--same_dim', type=lambda x: bool(_help._strtobool(x)), help='Only compare image having the same dimensions (width x height)', required=False, choices=[True, False], default=True)
+    serve_parser.add_argument('-p', '--show_progress', type=lambda x: bool(_help._strtobool(x)), help='Show the real-time progress of difPy.', required=False, choices=[True, False], default=True)
+    serve_parser.add_argument('-proc', '--processes', type=_help._convert_str_to_int, help=' Number of worker processes for multiprocessing.', required=False, default=os.cpu_count())
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        dif = build(args.directory, recursive=args.recursive, limit_extensions=args.limit_extensions, px_size=args.px_size, features=args.features, show_progress=args.show_progress, processes=args.processes)
+        serve(dif, host=args.host, port=args.port, similarity=args.similarity, rotate=args.rotate, same_dim=args.same_dim, show_progress=args.show_progress)
@@ -4,17 +4,41 @@ difPy - Python package for finding duplicate and similar images.
 https://github.com/elisemercury/Duplicate-Image-Finder
 '''
 from glob import glob
-from multiprocessing import Pool, current_process, freeze_support
+from multiprocessing import Pool, TimeoutError, current_process, freeze_support
+from multiprocessing.util import Finalize
+from multiprocessing.pool import ThreadPool
 import numpy as np
 from PIL import Image
 import os
 from datetime import datetime
+from time import perf_counter
 from pathlib import Path
 import argparse
 import json
+import sys
+import cProfile
 import warnings
-from itertools import combinations
+from itertools import chain
 from collections import defaultdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import shutil
+import gzip
+import csv
+import asyncio
+import hashlib
+import threading
+from functools import partial
+from copy import deepcopy
+
+try:
+    import resource
+except ImportError:
+    # resource is not available on Windows
+    resource = None
+
+# cProfile profilers of the current process, see _help._profiled
+_profilers = dict()
 
 def _initialize_multiprocessing():
     # Function that initializes multiprocessing
@@ -25,7 +49,7 @@ class build:
     '''
     A class used to initialize difPy and build its image repository
     '''
-    def __init__(self, *directory, recursive=True, in_folder=False, limit_extensions=True, px_size=50, show_progress=True, processes=os.cpu_count(), **kwargs):
+    def __init__(self, *directory, recursive=True, in_folder=False, limit_extensions=True, px_size=50, features='rgb', show_progress=True, processes=os.cpu_count(), callback=None, decode_timeout=None, maxtasksperchild=None, executor='auto', **kwargs):
         '''
         Parameters
         ----------
@@ -40,10 +64,20 @@ class build:
             Limit search to known image file extensions (default is True)
         px_size : int (optional)
             Image compression size in pixels (default is 50)
+        features : 'rgb', 'gray' (optional)
+            Color channels the image tensors are generated from (default is 'rgb')
         show_progress : bool (optional)
             Show the difPy progress bar in console (default is True)
         processes : int (optional)
             Number of worker processes for multiprocessing (see https://docs.python.org/3/library/multiprocessing.html#multiprocessing.pool.Pool)
+        callback : callable (optional)
+            Function that is called with a dictionary of progress metrics while building (default is None)
+        decode_timeout : int, float (optional)
+            Number of seconds after which the decoding of an image is aborted and the image is recorded as invalid file (default is None)
+        maxtasksperchild : int (optional)
+            Number of images a worker process decodes before it is replaced by a new worker process (default is None)
+        executor : 'auto', 'process', 'thread', 'serial' (optional)
+            Executor the images are decoded with (default is 'auto')
         '''
         # Validate input parameters
         self.__directory = _validate_param._directory(directory)
@@ -51,14 +85,19 @@ class build:
         self.__in_folder = _validate_param._in_folder(in_folder, recursive)
         self.__limit_extensions = _validate_param._limit_extensions(limit_extensions)
         self.__px_size = _validate_param._px_size(px_size)
+        self.__features = _validate_param._features(features)
         self.__show_progress = _validate_param._show_progress(show_progress)
         self.__processes = _validate_param._processes(processes)
+        self.__progress = _progress(_validate_param._callback(callback), 'build')
+        self.__decode_timeout = _validate_param._decode_timeout(decode_timeout)
+        self.__maxtasksperchild = _validate_param._maxtasksperchild(maxtasksperchild)
+        self.__executor = _validate_param._executor(executor, self.__decode_timeout, self.__maxtasksperchild)
         _validate_param._kwargs(kwargs)
 
         # Initialize multiprocessing
         _initialize_multiprocessing()
 
-        self._tensor_dictionary, self._id_to_shape_dictionary, self._filename_dictionary, self._id_to_group_dictionary, self._group_to_id_dictionary, self._invalid_files, self.stats = self._main()
+        self._tensor_dictionary, self._id_to_shape_dictionary, self._id_to_meta_dictionary, self._filename_dictionary, self._id_to_group_dictionary, self._group_to_id_dictionary, self._invalid_files, self.stats = self._main()
 
         return
 
@@ -70,14 +109,29 @@ class build:
             _help._progress_bar(count, total_count, task='preparing files')
 
         start_time = datetime.now()
+        self.__perf = {'stages' : dict(), 'decode_seconds' : [], 'workers' : dict(), 'executor' : None}
         # read files
+        self.__progress.stage('discovery')
+        start = perf_counter()
         valid_files, skipped_files = self._get_files()
+        self.__perf['stages']['discovery'] = perf_counter() - start
+        if self.__in_folder:
+            files_discovered = sum([len(files) for files in valid_files])
+        else:
+            files_discovered = len(valid_files)
+        self.__progress.update(done=files_discovered, files_discovered=files_discovered)
+        self.__progress.finish()
         if self.__show_progress:
             count += 1
             _help._progress_bar(count, total_count, task='preparing files')
         
         # build image dictionary from files
-        tensor_dictionary, id_to_shape_dictionary, filename_dictionary, id_to_group_dictionary, group_to_id_dictionary, invalid_files = self._build_image_dictionaries(valid_files)    
+        self.__progress.stage('decode', total=files_discovered)
+        start = perf_counter()
+        tensor_dictionary, id_to_shape_dictionary, id_to_meta_dictionary, filename_dictionary, id_to_group_dictionary, group_to_id_dictionary, invalid_files = self._build_image_dictionaries(valid_files)    
+        self.__perf['stages']['decode'] = perf_counter() - start
+        self.__perf['bytes_read'] = sum([meta['filesize'] for meta in id_to_meta_dictionary.values()])
+        self.__progress.finish()
 
         end_time = datetime.now()
         if self.__show_progress:
@@ -85,13 +139,13 @@ class build:
             _help._progress_bar(count, total_count, task='preparing files')
         
         # generate build statistics
-        stats = _generate_stats.build(total_files=len(filename_dictionary), invalid_files=invalid_files, skipped_files=skipped_files, directory=self.__directory, start_time=start_time, end_time=end_time, recursive=self.__recursive, in_folder=self.__in_folder, limit_extensions=self.__limit_extensions, px_size=self.__px_size, processes=self.__processes)
+        stats = _generate_stats.build(performance=self.__perf, total_files=len(filename_dictionary), invalid_files=invalid_files, skipped_files=skipped_files, directory=self.__directory, start_time=start_time, end_time=end_time, recursive=self.__recursive, in_folder=self.__in_folder, limit_extensions=self.__limit_extensions, px_size=self.__px_size, features=self.__features, processes=self.__processes, executor=self.__executor)
 
         if self.__show_progress:
             count += 1
             _help._progress_bar(count, total_count, task='preparing files')
 
-        return tensor_dictionary, id_to_shape_dictionary, filename_dictionary, id_to_group_dictionary, group_to_id_dictionary, invalid_files, stats
+        return tensor_dictionary, id_to_shape_dictionary, id_to_meta_dictionary, filename_dictionary, id_to_group_dictionary, group_to_id_dictionary, invalid_files, stats
 
     def _get_files(self):
         # Function that searches for files in the input directories
@@ -176,6 +230,7 @@ class build:
         # Function that builds dictionaries of image tensors and metadata
         tensor_dictionary = dict()
         id_to_shape_dictionary = dict()
+        id_to_meta_dictionary = dict()
         filename_dictionary = dict()
         invalid_files = dict()
         id_to_group_dictionary = dict()
@@ -186,31 +241,8 @@ class build:
             for j in range(0, len(valid_files)):
                 group_id = f"group_{j}"
                 group_img_ids = []
-                with Pool(processes=self.__processes) as pool:
-                    file_nums = [(i, valid_files[j][i]) for i in range(len(valid_files[j]))]
-                    for output in pool.starmap(self._generate_tensor, file_nums):
-                        if isinstance(output, dict):
-                            invalid_files.update(output)
-                            count += 1
-                        else:
-                            img_id = count
-                            filename = output[0]
-                            tensor = output[1]
-                            shape = output[2]
-                            group_img_ids.append(img_id)
-                            # update the dictionaries
-                            id_to_group_dictionary.update({img_id : group_id})
-                            id_to_shape_dictionary.update({img_id : shape})
-                            filename_dictionary.update({img_id : valid_files[j][filename]})
-                            tensor_dictionary.update({img_id : tensor})
-                            count += 1                         
-                group_to_id_dictionary.update({group_id : group_img_ids})
-        
-        else:
-            # create build for Union of all directories
-            with Pool(processes=self.__processes) as pool:
-                file_nums = [(i, valid_files[i]) for i in range(len(valid_files))]
-                for output in pool.starmap(self._generate_tensor, file_nums):
+                file_nums = [(i, valid_files[j][i]) for i in range(len(valid_files[j]))]
+                for output in self._generate_tensors(file_nums):
                     if isinstance(output, dict):
                         invalid_files.update(output)
                         count += 1
@@ -219,68 +251,393 @@ class build:
                         filename = output[0]
                         tensor = output[1]
                         shape = output[2]
+                        meta = output[3]
+                        group_img_ids.append(img_id)
                         # update the dictionaries
+                        id_to_group_dictionary.update({img_id : group_id})
                         id_to_shape_dictionary.update({img_id : shape})
-                        filename_dictionary.update({img_id : valid_files[filename]})
+                        id_to_meta_dictionary.update({img_id : meta})
+                        filename_dictionary.update({img_id : valid_files[j][filename]})
                         tensor_dictionary.update({img_id : tensor})
-                        count += 1         
-        return tensor_dictionary, id_to_shape_dictionary, filename_dictionary, id_to_group_dictionary, group_to_id_dictionary, invalid_files
+                        count += 1                         
+                group_to_id_dictionary.update({group_id : group_img_ids})
+        
+        else:
+            # create build for Union of all directories
+            file_nums = [(i, valid_files[i]) for i in range(len(valid_files))]
+            for output in self._generate_tensors(file_nums):
+                if isinstance(output, dict):
+                    invalid_files.update(output)
+                    count += 1
+                else:
+                    img_id = count
+                    filename = output[0]
+                    tensor = output[1]
+                    shape = output[2]
+                    meta = output[3]
+                    # update the dictionaries
+                    id_to_shape_dictionary.update({img_id : shape})
+                    id_to_meta_dictionary.update({img_id : meta})
+                    filename_dictionary.update({img_id : valid_files[filename]})
+                    tensor_dictionary.update({img_id : tensor})
+                    count += 1         
+        return tensor_dictionary, id_to_shape_dictionary, id_to_meta_dictionary, filename_dictionary, id_to_group_dictionary, group_to_id_dictionary, invalid_files
+
+    def _generate_tensors(self, file_nums):
+        # Function that generates the tensors of a list of (num, file) images in a pool and yields them in order
+        if self.__decode_timeout is not None:
+            yield from self._generate_tensors_timeout(file_nums)
+            return
+        if self.__maxtasksperchild is not None:
+            # worker recycling applies to single images
+            chunksize = 1
+        else:
+            chunksize = _help._map_chunksize(len(file_nums), self.__processes)
+        with _decode_warnings(), self._pool(len(file_nums)) as pool:
+            for (num, file), (output, seconds, usage) in zip(file_nums, pool.imap(_help._generate_tensor_args, self._tensor_args(file_nums), chunksize)):
+                yield self._add_tensor_output(file, output, seconds, usage)
+
+    def _generate_tensors_timeout(self, file_nums):
+        # Function that generates the tensors of a list of (num, file) images with a deadline per image and yields them in order
+        # only as many images as there are workers are submitted at once, so that the deadline of an image starts when a worker picks it up
+        queue = list(range(len(file_nums)))
+        tensor_args = self._tensor_args(file_nums)
+        outputs = dict()
+        next_output = 0
+        while next_output < len(file_nums):
+            with _decode_warnings(), self._pool(len(queue)) as pool:
+                running = dict()
+                finished = threading.Event()
+                timed_out = False
+                while not timed_out and next_output < len(file_nums):
+                    while len(running) < self.__processes and len(queue) > 0:
+                        i = queue.pop(0)
+                        callback = lambda output: finished.set()
+                        running[i] = (pool.apply_async(_help._generate_tensor_args, (tensor_args[i],), callback=callback, error_callback=callback), perf_counter() + self.__decode_timeout)
+                    finished.clear()
+                    for i, (output, deadline) in list(running.items()):
+                        if output.ready():
+                            outputs[i] = output.get()
+                            del running[i]
+                        elif perf_counter() >= deadline:
+                            # the worker is stuck on the image: record it as invalid and restart the pool
+                            outputs[i] = None
+                            del running[i]
+                            timed_out = True
+                    while next_output in outputs:
+                        num, file = file_nums[next_output]
+                        output = outputs.pop(next_output)
+                        next_output += 1
+                        if output is None:
+                            print(f"Error DecodeTimeout loading image #{num} : '{file}' -> decoding exceeded {self.__decode_timeout} seconds")
+                            self.__perf['decode_seconds'].append((self.__decode_timeout, str(Path(file))))
+                            self.__progress.update(invalid_files=1)
+                            yield {str(Path(file)) : f'DecodeTimeout: decoding exceeded {self.__decode_timeout} seconds.'}
+                        else:
+                            yield self._add_tensor_output(file, *output)
+                    if not timed_out and len(running) > 0:
+                        # wait until an image is decoded or the earliest deadline passes
+                        finished.wait(max(min([deadline for output, deadline in running.values()]) - perf_counter(), 0))
+                # the images that were still decoding when the pool was terminated are decoded again
+                queue = sorted(running.keys()) + queue
+
+    def _tensor_args(self, file_nums):
+        # Helper function that adds the build parameters to the (num, file) images, so that only these arguments and not the build object are sent to the workers
+        return [(num, file, self.__px_size, self.__features) for num, file in file_nums]
+
+    def _add_tensor_output(self, file, output, seconds, usage):
+        # Helper function that records the performance metrics of a decoded image and returns its output
+        self.__perf['decode_seconds'].append((seconds, str(Path(file))))
+        _help._add_worker_usage(self.__perf['workers'], usage)
+        if isinstance(output, dict):
+            self.__progress.update(invalid_files=1)
+        else:
+            self.__progress.update(images_decoded=1)
+        return output
+
+    def _pool(self, n_files):
+        # Function that returns the pool of workers the images are decoded in
+        executor = self.__executor
+        if executor == 'auto':
+            if self.__decode_timeout is not None or self.__maxtasksperchild is not None:
+                # timeouts and worker recycling require worker processes
+                executor = 'process'
+            elif n_files <= 10 or self.__processes == 1:
+                executor = 'serial'
+            else:
+                # the image decoder releases the GIL, so threads decode in parallel without pickling the tensors
+                executor = 'thread'
+        self.__perf['executor'] = executor
+        return _help._pool(executor, self.__processes, maxtasksperchild=self.__maxtasksperchild, initializer=_decode_warnings._install)
 
     def _generate_tensor(self, num: int, file: str) -> dict | tuple:
-        # Function that generates a tensor of an image.
-        try:
-            # Handle warnings as exceptions
-            warnings.simplefilter('error', UserWarning)
-            warnings.simplefilter('error', Image.DecompressionBombWarning)
+        # Function that generates a tensor of an image with the parameters of the build, see _help._generate_tensor
+        return _help._generate_tensor(num, file, self.__px_size, self.__features)
 
-            img = Image.open(file)
-            if img.getbands() != ('R', 'G', 'B'):
-                img = img.convert('RGB')
-            shape = np.asarray(img).shape # new
-            img = img.resize((self.__px_size, self.__px_size), resample=Image.BICUBIC)
-            img = np.asarray(img)
-            return (num, img, shape)
-        except Exception as e:
-            print(f"Error {e.__class__.__name__} loading image #{num} : '{file}' -> {e}")
-            if e.__class__.__name__== 'UnidentifiedImageError':
-                return {str(Path(file)) : 'UnidentifiedImageError: file could not be identified as image.'}
-            else:
-                return {str(Path(file)) : str(e)}
+class plan(build):
+    '''
+    A class used to estimate the cost of a difPy search before running it, by building a sample of the images
+    '''
+    def __init__(self, *directory, recursive=True, in_folder=False, limit_extensions=True, px_size=50, features='rgb', similarity='duplicates', rotate=True, same_dim=True, aspect_tolerance=None, sample_size=100, show_progress=True, processes=os.cpu_count(), **kwargs):
+        '''
+        Parameters
+        ----------
+        directory : str, list
+            Paths of the directories or the files to be searched
+        recursive : bool (optional)
+            Search recursively within the directories (default is True)
+        in_folder : bool (optional)
+            If False, searches for matches in the union of directories (default is False)
+            If True, searches for matches in separate/isolated directories
+        limit_extensions : bool (optional)
+            Limit search to known image file extensions (default is True)
+        px_size : int (optional)
+            Image compression size in pixels (default is 50)
+        features : 'rgb', 'gray' (optional)
+            Color channels the image tensors are generated from (default is 'rgb')
+        similarity : 'duplicates', 'similar', float (optional)
+            Image comparison similarity threshold (mse) of the planned search (default is 'duplicates', 0)
+        rotate : bool (optional)
+            Rotates images on comparison (default is True)
+        same_dim : bool (optional)
+            Only searches for duplicate/similar images that have the same dimensions (width x height in pixels) (default is True)
+        aspect_tolerance : float (optional)
+            Only compares images whose aspect ratios differ by at most this relative tolerance, requires same_dim=False (default is None)
+        sample_size : int (optional)
+            Number of images that are decoded and compared to estimate the cost (default is 100)
+        show_progress : bool (optional)
+            Show the difPy progress bar in console (default is True)
+        processes : int (optional)
+            Number of worker processes the wall time is projected for (default is os.cpu_count())
+        '''
+        # Validate input parameters
+        self.__in_folder = _validate_param._in_folder(in_folder, recursive)
+        self.__similarity = _validate_param._similarity(similarity)
+        self.__rotate = _validate_param._rotate(rotate)
+        self.__same_dim = _validate_param._same_dim(same_dim, self.__similarity)
+        self.__aspect_tolerance = _validate_param._aspect_tolerance(aspect_tolerance, self.__same_dim)
+        self.__sample_size = _validate_param._sample_size(sample_size)
+        # the projection may target another machine, the sample is decoded with the processes available on this one
+        self.__processes = _validate_param._projected_processes(processes)
+
+        # build the sampled images
+        super().__init__(*directory, recursive=recursive, in_folder=in_folder, limit_extensions=limit_extensions, px_size=px_size, features=features, show_progress=show_progress, processes=min(self.__processes, os.cpu_count()), **kwargs)
+
+        self.report = self._estimate()
+        return
+
+    def _get_files(self):
+        # Function that searches for files in the input directories and returns a random sample of them
+        valid_files, skipped_files = super()._get_files()
+        if self.__in_folder:
+            folders = [list(files) for files in valid_files]
+        else:
+            folders = [list(valid_files)]
+        self.__folder_sizes = [len(files) for files in folders]
+
+        # sample the same files on every run
+        files = [(i, file) for i, files in enumerate(folders) for file in files]
+        sample = np.random.default_rng(0).choice(len(files), size=min(self.__sample_size, len(files)), replace=False)
+        sampled_folders = [[] for files in folders]
+        for j in sorted(sample):
+            i, file = files[j]
+            sampled_folders[i].append(file)
+        self.__sampled = len(sample)
+
+        if self.__in_folder:
+            sampled_files = np.array([np.array(files) for files in sampled_folders if len(files) > 0], dtype=object)
+        else:
+            sampled_files = np.array(sampled_folders[0], dtype=object)
+        return sampled_files, skipped_files
+
+    def _estimate(self):
+        # Function that extrapolates the cost of the full build and search from the sampled images
+        tensors = list(self._tensor_dictionary.values())
+        shapes = [tuple(sorted(self._id_to_shape_dictionary[img_id])) for img_id in self._tensor_dictionary.keys()]
+        valid_ratio = len(tensors) / self.__sampled if self.__sampled > 0 else 0
+
+        # share of the image pairs that are not pruned by the same_dim or aspect_tolerance check
+        if self.__same_dim and len(shapes) > 1:
+            shape_counts = defaultdict(int)
+            for shape in shapes:
+                shape_counts[shape] += 1
+            compared_ratio = sum([count*(count-1) for count in shape_counts.values()]) / (len(shapes)*(len(shapes)-1))
+        elif self.__aspect_tolerance is not None and len(shapes) > 1:
+            keys = np.log([_compare_imgs._aspect_ratio(shape) for shape in shapes])
+            within = np.abs(keys[:, None] - keys[None, :]) <= np.log1p(self.__aspect_tolerance)
+            compared_ratio = (within.sum() - len(shapes)) / (len(shapes)*(len(shapes)-1))
+        else:
+            compared_ratio = 1.0
+
+        kernel_seconds = self._time_kernels(tensors, shapes)
+        tensor_bytes = int(np.mean([tensor.nbytes for tensor in tensors])) if len(tensors) > 0 else 0
+        pair_bytes = sys.getsizeof((0, 0)) + 8
+
+        valid_files, pairs_total, pairs_compared, search_seconds, pair_list_bytes = 0, 0, 0, 0, 0
+        for folder_size in self.__folder_sizes:
+            n = round(folder_size * valid_ratio)
+            pairs = n*(n-1)//2
+            compared = round(pairs * compared_ratio)
+            # search algorithm as selected by difPy.search
+            algorithm = 'classic' if n <= 5000 else 'batch'
+            search_seconds += compared * kernel_seconds[algorithm]['compared'] + (pairs - compared) * kernel_seconds[algorithm]['pruned']
+            if algorithm == 'classic':
+                # the classic algorithm holds the list of all pairs of a folder in memory
+                pair_list_bytes = max(pair_list_bytes, pairs * pair_bytes)
+            valid_files += n
+            pairs_total += pairs
+            pairs_compared += compared
+
+        build_performance = self.stats['process']['build']['performance']
+        decode_seconds = build_performance['decode']['seconds_total'] / len(tensors) if len(tensors) > 0 else 0
+        # executors as selected by difPy.build and difPy.search with executor 'auto': small inputs are processed serially
+        build_seconds = build_performance['stages_seconds']['discovery']
+        for folder_size in self.__folder_sizes:
+            build_seconds += decode_seconds * folder_size / (self.__processes if folder_size > 10 and self.__processes > 1 else 1)
+        search_executor = 'serial' if pairs_total <= 10000 or self.__processes == 1 else 'process'
+        if search_executor == 'process':
+            search_seconds = search_seconds / self.__processes
+        # every worker process receives a copy of the tensor store
+        tensor_store_bytes = valid_files * (tensor_bytes + sys.getsizeof(np.empty(0)))
+        workers = self.__processes if search_executor == 'process' else 0
+
+        return {
+            'files' : {
+                'discovered' : sum(self.__folder_sizes),
+                'sampled' : self.__sampled,
+                'invalid_in_sample' : self.__sampled - len(tensors),
+                'estimated_valid' : valid_files,
+            },
+            'pairs' : {
+                'total' : pairs_total,
+                'compared' : pairs_compared,
+                'pruned' : pairs_total - pairs_compared,
+            },
+            'memory_bytes' : {
+                'tensor_store' : tensor_store_bytes,
+                'per_worker' : tensor_store_bytes,
+                'pair_list' : pair_list_bytes,
+                'peak' : tensor_store_bytes * (workers + 1) + pair_list_bytes,
+            },
+            'projected_seconds' : {
+                'build' : np.round(build_seconds, 4),
+                'search' : np.round(search_seconds, 4),
+                'total' : np.round(build_seconds + search_seconds, 4),
+            },
+            'kernel_seconds' : {
+                'decode_per_image' : decode_seconds,
+                'compare_per_pair' : kernel_seconds,
+            },
+            'parameters' : {
+                'similarity_mse' : self.__similarity,
+                'rotate' : self.__rotate,
+                'same_dim' : self.__same_dim,
+                'aspect_tolerance' : self.__aspect_tolerance,
+                'processes' : self.__processes,
+                'executor' : search_executor,
+                'sample_size' : self.__sample_size,
+            }
+        }
+
+    def _time_kernels(self, tensors, shapes, n_pairs=200):
+        # Function that measures the seconds per compared and per pruned image pair of both search algorithms
+        kernel_seconds = {algorithm : {'compared' : 0.0, 'pruned' : 0.0} for algorithm in ['classic', 'batch']}
+        if len(tensors) == 0:
+            return kernel_seconds
+        rng = np.random.default_rng(0)
+        pairs = [(rng.integers(len(tensors)), rng.integers(len(tensors))) for i in range(n_pairs)]
+
+        # classic algorithm: shape check per pair, equality check and MSE per batch of pairs
+        start = perf_counter()
+        for i, j in pairs:
+            _compare_imgs._compare_shape(shapes[i], shapes[j])
+        kernel_seconds['classic']['pruned'] = (perf_counter() - start) / n_pairs
+        start = perf_counter()
+        tensor_A_list = np.stack([tensors[i] for i, j in pairs])
+        tensor_B_list = np.stack([tensors[j] for i, j in pairs])
+        non_equal = np.where(~_compare_imgs._check_equality(tensor_A_list, tensor_B_list))[0]
+        _compare_imgs._compute_mse_batch(tensor_A_list[non_equal], tensor_B_list[non_equal], rotate=self.__rotate, threshold=self.__similarity)
+        kernel_seconds['classic']['compared'] = kernel_seconds['classic']['pruned'] + (perf_counter() - start) / n_pairs
+
+        # batch algorithm: shape check and sum per pair, MSE only when searching for similar images
+        start = perf_counter()
+        for i, j in pairs:
+            sorted(shapes[j])
+        kernel_seconds['batch']['pruned'] = (perf_counter() - start) / n_pairs
+        start = perf_counter()
+        sums = [np.sum(tensor_B) for tensor_B in tensor_B_list]
+        if self.__similarity > 0:
+            _compare_imgs._compute_mse_batch(tensor_A_list[0], tensor_B_list, rotate=self.__rotate, threshold=self.__similarity)
+        kernel_seconds['batch']['compared'] = kernel_seconds['batch']['pruned'] + (perf_counter() - start) / n_pairs
+        return kernel_seconds
 
 class search:
     '''
     A class used to search for matches in a difPy image repository
     '''
-    def __init__(self, difpy_obj, similarity='duplicates', rotate=True, same_dim=True, show_progress=True, processes=os.cpu_count(), chunksize=None, **kwargs):
+    def __init__(self, difpy_obj, similarity='duplicates', rotate=True, same_dim=True, aspect_tolerance=None, show_progress=True, processes=os.cpu_count(), chunksize=None, against=None, rank_by='resolution', callback=None, profile=None, executor='auto', **kwargs):
         '''
         Parameters
         ----------
         difPy_obj : difPy.dif.build
             difPy object containing the build image repository
-        similarity : 'duplicates', 'similar', float (optional)
+        similarity : 'duplicates', 'similar', float, list (optional)
             Image comparison similarity threshold (mse) (default is 'duplicates', 0)
+            If a list of thresholds is given, the images are compared once and result, lower_quality and stats are dictionaries with one entry per threshold
         rotate : bool (optional)
             Rotates images on comparison (default is True)
         same_dim : bool (optional)
             Only searches for duplicate/similar images that have the same dimensions (width x height in pixels) (default is True)
+        aspect_tolerance : float (optional)
+            Only compares images whose aspect ratios differ by at most this relative tolerance, requires same_dim=False (default is None)
         show_progress : bool (optional)
             Show the difPy progress bar in console (default is True)
         processes : int (optional)
             Number of worker processes for multiprocessing (default is os.cpu_count()) (see https://docs.python.org/3/library/multiprocessing.html#multiprocessing.pool.Pool)
         chunksize : int (optional)
             This parameter is only relevant when working with large image datasets (> 5k images). Sets the batch size at which the job is simultaneously processed when multiprocessing. (see https://docs.python.org/3/library/multiprocessing.html#multiprocessing.pool.Pool.imap_unordered)
+        against : difPy.dif.build (optional)
+            difPy object containing a second image repository. If given, only the images of difpy_obj are compared against the images of this repository (default is None)
+        rank_by : 'resolution', 'filesize', 'newest', 'oldest' (optional)
+            Policy by which the highest quality image of a match group is selected (default is 'resolution')
+        callback : callable (optional)
+            Function that is called with a dictionary of progress metrics while searching (default is None)
+        profile : str (optional)
+            Path of a directory the cProfile profiles of the comparison stage are written to, one file per worker process (default is None)
+        executor : 'auto', 'process', 'thread', 'serial' (optional)
+            Executor the images are compared with (default is 'auto')
 
         '''
         # Validate input parameters
         self.__difpy_obj = difpy_obj
-        self.__similarity = _validate_param._similarity(similarity)
+        self.__similarity = _validate_param._similarity(similarity, multiple=True)
+        if isinstance(self.__similarity, list):
+            # the images are compared once at the highest threshold
+            self.__thresholds = self.__similarity
+            self.__similarity = max(self.__thresholds)
+        else:
+            self.__thresholds = None
         self.__rotate = _validate_param._rotate(rotate)
         self.__same_dim = _validate_param._same_dim(same_dim, self.__similarity)
+        self.__aspect_tolerance = _validate_param._aspect_tolerance(aspect_tolerance, self.__same_dim)
         self.__show_progress = _validate_param._show_progress(show_progress)
         self.__processes = _validate_param._processes(processes)
         self.__chunksize = _validate_param._chunksize(chunksize)
-        self.__in_folder = self.__difpy_obj.stats['process']['build']['parameters']['in_folder']
+        self.__rank_by = _validate_param._rank_by(rank_by)
+        self.__progress = _progress(_validate_param._callback(callback), 'search')
+        self.__profile = _validate_param._profile(profile)
+        self.__executor = _validate_param._executor(executor, profile=self.__profile)
+        self.__against_obj = _validate_param._against(against, self.__difpy_obj)
+        if self.__against_obj is None:
+            self.__compare_obj = self.__difpy_obj
+            self.__in_folder = self.__difpy_obj.stats['process']['build']['parameters']['in_folder']
+        else:
+            # matches are always searched in the union of both repositories
+            self.__compare_obj = self.__against_obj
+            self.__in_folder = False
         _validate_param._kwargs(kwargs)
+        # images compared by the comparison groups and their stacked tensors, see _get_stacked
+        self.__stacked = None
 
         # Initialize multiprocessing
         _initialize_multiprocessing()
@@ -293,63 +650,74 @@ class search:
     def _main(self):
         # Function that runs the full Search workflow
         start_time = datetime.now()
+        self.__keep_dictionary = dict()
+        self.__perf = {'stages' : dict(), 'pairs' : {'compared' : 0, 'pruned' : 0}, 'identical_images' : 0, 'workers' : dict(), 'executor' : None}
 
-        if self.__in_folder:
+        if self.__against_obj is not None:
+            # search the first repository against the second repository
+            result_raw = self._search_against()
+        elif self.__in_folder:
             # search directories separately
-            result = self._search_infolder()
-            result = self._format_result_infolder(result)
-            lower_quality, duplicate_count, similar_count = self._search_metadata_infolder(result)
+            result_raw = self._search_infolder()
         else:
             # search union of all directories
-            result = self._search_union()
-            result = self._format_result_union(result)
-            # compare image qualities and computes process metadata
-            lower_quality, duplicate_count, similar_count = self._search_metadata_union(result)
+            result_raw = self._search_union()
+
+        if self.__thresholds is None:
+            result, lower_quality, duplicate_count, similar_count = self._process_result(result_raw, self.__similarity)
+        else:
+            # the matches of every threshold are a subset of the matches of the highest threshold
+            result, lower_quality, duplicate_count, similar_count = dict(), dict(), dict(), dict()
+            for similarity in self.__thresholds:
+                matches = [match for match in result_raw if match[2] <= similarity]
+                result[similarity], lower_quality[similarity], duplicate_count[similarity], similar_count[similarity] = self._process_result(matches, similarity)
 
         end_time = datetime.now()
 
         # generate process stats
-        stats = _generate_stats.search(build_stats=self.__difpy_obj.stats, start_time=start_time, end_time=end_time, similarity = self.__similarity, rotate=self.__rotate, same_dim=self.__same_dim, processes=self.__processes, files_searched=len(self.__difpy_obj._tensor_dictionary), duplicate_count=duplicate_count, similar_count=similar_count, chunksize=self.__chunksize)
+        files_searched = len(self.__difpy_obj._tensor_dictionary)
+        if self.__against_obj is not None:
+            files_searched += len(self.__against_obj._tensor_dictionary)
+            against = self.__against_obj.stats['directory']
+        else:
+            against = None
+        stats_kwargs = dict(performance=self.__perf, profile=self.__profile, start_time=start_time, end_time=end_time, rotate=self.__rotate, same_dim=self.__same_dim, aspect_tolerance=self.__aspect_tolerance, processes=self.__processes, files_searched=files_searched, chunksize=self.__chunksize, against=against, rank_by=self.__rank_by, executor=self.__executor)
+        if self.__thresholds is None:
+            stats = _generate_stats.search(build_stats=self.__difpy_obj.stats, similarity=self.__similarity, duplicate_count=duplicate_count, similar_count=similar_count, **stats_kwargs)
+        else:
+            # every threshold gets its own copy of the build stats
+            stats = {similarity : _generate_stats.search(build_stats=deepcopy(self.__difpy_obj.stats), similarity=similarity, duplicate_count=duplicate_count[similarity], similar_count=similar_count[similarity], **stats_kwargs) for similarity in self.__thresholds}
 
         return result, lower_quality, stats
 
+    def _process_result(self, result_raw, similarity):
+        # Function that groups the matches of a similarity threshold, ranks them and formats the result
+        if self.__against_obj is not None:
+            result = self._timed('grouping', self._group_result_against, result_raw)
+            lower_quality, duplicate_count, similar_count = self._timed('ranking', self._search_metadata_against, result)
+            result = self._timed('formatting', self._format_result_union, result)
+        elif self.__in_folder:
+            result = self._timed('grouping', self._group_result_infolder, result_raw, self._get_paths_from_groups())
+            lower_quality, duplicate_count, similar_count = self._timed('ranking', self._search_metadata_infolder, result, similarity)
+            result = self._timed('formatting', self._format_result_infolder, result)
+        else:
+            result = self._timed('grouping', self._group_result_union, result_raw)
+            # compare image qualities and computes process metadata
+            lower_quality, duplicate_count, similar_count = self._timed('ranking', self._search_metadata_union, result, similarity)
+            result = self._timed('formatting', self._format_result_union, result)
+        return result, lower_quality, duplicate_count, similar_count
+
     def _search_union(self):
         # Function that performs search in the union of all directories
-        result_raw = list()
-        self.__count = 0
+        ids = list(self.__difpy_obj._tensor_dictionary.keys())
+        self.__progress.stage('search', total=len(ids)*(len(ids)-1)//2)
 
-        if len(self.__difpy_obj._tensor_dictionary.keys()) <= 5000:
-            # search algorithm for smaller datasets, <= 5k images
-            id_combinations = list(combinations(list(self.__difpy_obj._tensor_dictionary.keys()), 2))
-            with Pool(processes=self.__processes) as pool:
-                output = pool.map(self._find_matches, id_combinations)
-            for i in output:
-                if i:
-                    # if matches found, add to result
-                    result_raw = self._add_to_result(result_raw, i)
-            self.__count += 1       
-            if self.__show_progress:
-                _help._progress_bar(self.__count, 1, task=f'searching files')
-
-        else:
-            # search algorithm for smaller datasets, > 5k images
-            if self.__chunksize == None:
-                self.__chunksize = round(1000000 / len(self.__difpy_obj._tensor_dictionary.keys()))
-                if self.__chunksize < 1:
-                    self.__chunksize = 1
-            with Pool(processes=self.__processes) as pool:
-                for output in pool.imap_unordered(self._find_matches_batch, self._yield_comparison_group(), self.__chunksize):
-                    if len(output) > 0:
-                        # if matches found, add to result
-                        result_raw = result_raw + output
-                    self.__count += 1  
-                    if self.__show_progress:
-                        _help._progress_bar(self.__count, len(self.__difpy_obj._tensor_dictionary.keys())-1, task=f'searching files')     
-
-        # format the end result
-        result = self._group_result_union(result_raw)
+        with self._pool(len(ids)*(len(ids)-1)//2) as pool:
+            result_raw = self._search_ids(pool, ids, progress_bar=True)
+            self._close_pool(pool)
+        self.__progress.finish()
         
-        return result
+        return result_raw
 
     def _search_infolder(self):
         # Function that performs search in isolated/separate directories
@@ -357,34 +725,209 @@ class search:
         # Get folder paths for each group
         grouped_img_ids = [img_ids for group_id, img_ids in self.__difpy_obj._group_to_id_dictionary.items()]
         self.__count = 0
+        self.__progress.stage('search', total=sum([len(ids)*(len(ids)-1)//2 for ids in grouped_img_ids]))
 
-        with Pool(processes=self.__processes) as pool:
+        with self._pool(sum([len(ids)*(len(ids)-1)//2 for ids in grouped_img_ids])) as pool:
             for ids in grouped_img_ids:
-                if len(ids) <= 5000:
-                    # search algorithm for smaller datasets, <= 5k images
-                    id_combinations = list(combinations(ids, 2))
-                    output = pool.map(self._find_matches, id_combinations)
-                    for i in output:
-                        if i:
-                            # if matches found, add to result
-                            result = self._add_to_result(result, i)
-                    self.__count += 1        
-                else:
-                    # search algorithm for bigger datasets, > 5k images
-                    if self.__chunksize == None:
-                        self.__chunksize = round(1000000 / len(ids))
-                        if self.__chunksize < 1:
-                            self.__chunksize = 1
-                    for output in pool.imap_unordered(self._find_matches_batch, self._yield_comparison_group(), self.__chunksize):
-                        if len(output) > 0:
-                            # if matches found, add to result
-                            result = result + output
-                    self.__count += 1  
+                result = result + self._search_ids(pool, ids)
+                self.__count += 1  
                 if self.__show_progress:
                     _help._progress_bar(self.__count, len(grouped_img_ids), task=f'searching files')
+            self._close_pool(pool)
+        self.__progress.finish()
         
         return result
 
+    def _search_against(self):
+        # Function that performs search between the images of two repositories
+        ids_A = list(self.__difpy_obj._tensor_dictionary.keys())
+        ids_B = list(self.__against_obj._tensor_dictionary.keys())
+        self.__progress.stage('search', total=len(ids_A)*len(ids_B))
+
+        with self._pool(len(ids_A)*len(ids_B)) as pool:
+            result_raw = self._search_ids(pool, ids_A, ids_B, progress_bar=True)
+            self._close_pool(pool)
+        self.__progress.finish()
+
+        return result_raw
+
+    def _pool(self, n_pairs):
+        # Function that returns the pool of workers the image pairs are compared in
+        executor = self.__executor
+        if executor == 'auto':
+            # starting worker processes and sending them the tensors only pays off for larger searches
+            executor = 'serial' if n_pairs <= 10000 or self.__processes == 1 else 'process'
+        self.__perf['executor'] = executor
+        if self.__profile is not None:
+            if executor == 'process':
+                return _help._pool(executor, self.__processes, initializer=_help._init_profile, initargs=(self.__profile, 'search'))
+            # every search starts with a new profiler
+            _profilers.pop('search', None)
+        return _help._pool(executor, self.__processes)
+
+    def _close_pool(self, pool):
+        # Function that writes the profiles of the search once all tasks of the pool are done
+        if self.__profile is None:
+            return
+        if isinstance(pool, _serial_pool):
+            _help._write_profile(self.__profile, 'search')
+        else:
+            # worker processes write their profile when they exit, which they only do when the pool is closed and not terminated
+            pool.close()
+            pool.join()
+
+    def _search_ids(self, pool, ids_A, ids_B=None, progress_bar=False):
+        # Function that compares all pairs among ids_A, or all pairs between ids_A and ids_B if given
+        # images with identical tensors are only compared once, by the first image of their group
+        start = perf_counter()
+        groups_A = self._collapse_ids(ids_A, self.__difpy_obj)
+        reps_A = list(groups_A.keys())
+        if ids_B is None:
+            positions = {img_id : i for i, img_id in enumerate(ids_A)}
+            groups_B = groups_A
+            band = None if self.__aspect_tolerance is None else _aspect_band(reps_A, self.__difpy_obj, self.__aspect_tolerance)
+            comparison_groups = chain(self._yield_comparison_group(reps_A, band=band), self._yield_reverse_comparison_group(groups_A, positions, band=band))
+            n_images, n_groups, group_size = len(reps_A), len(reps_A) - 1, len(reps_A)
+            n_pairs = len(ids_A)*(len(ids_A)-1)//2
+        else:
+            positions = None
+            groups_B = self._collapse_ids(ids_B, self.__compare_obj)
+            band = None if self.__aspect_tolerance is None else _aspect_band(list(groups_B.keys()), self.__compare_obj, self.__aspect_tolerance)
+            comparison_groups = self._yield_comparison_group(reps_A, list(groups_B.keys()), band=band)
+            n_images, n_groups, group_size = len(reps_A) + len(groups_B), len(reps_A), len(groups_B)
+            n_pairs = len(ids_A)*len(ids_B)
+        self.__perf['identical_images'] += len(ids_A) - len(groups_A) + (0 if ids_B is None else len(ids_B) - len(groups_B))
+        self.__stacked = (list(groups_B.keys()), None, None)
+        self._add_stage_time('collapse', perf_counter() - start)
+
+        result_raw = self._compare_groups(pool, comparison_groups, n_images, n_groups, group_size, progress_bar=progress_bar)
+
+        start = perf_counter()
+        n_matches = len(result_raw)
+        result_raw = self._expand_matches(result_raw, groups_A, groups_B, positions)
+        self._add_stage_time('collapse', perf_counter() - start)
+        # the pairs of identical images were not compared, but are reported as compared pairs with their expanded matches
+        n_settled = max(n_pairs - self.__compared_pairs, 0)
+        self.__progress.update(done=n_settled, pairs_compared=n_settled, matches_found=len(result_raw) - n_matches)
+        return result_raw
+
+    def _compare_groups(self, pool, comparison_groups, n_images, n_groups, group_size, progress_bar=False):
+        # Function that compares the image pairs of comparison groups, each group compares one image with up to group_size images
+        result_raw = list()
+        count = 0
+        self.__compared_pairs = 0
+
+        if n_images <= 5000:
+            # search algorithm for smaller datasets, <= 5k images
+            start = perf_counter()
+            id_combinations = [ids for group in comparison_groups for ids in group]
+            chunksize = _help._map_chunksize(len(id_combinations), self.__processes)
+            id_chunks = [id_combinations[i:i+chunksize] for i in range(0, len(id_combinations), chunksize)]
+            self._add_stage_time('pair_generation', perf_counter() - start)
+            start = perf_counter()
+            for output in pool.imap(self._find_matches_chunk, id_chunks):
+                # if matches found, add to result
+                result_raw.extend(self._add_chunk_output(output))
+            self._add_stage_time('compare', perf_counter() - start)
+            if self.__show_progress and progress_bar:
+                _help._progress_bar(1, 1, task=f'searching files')
+
+        else:
+            # search algorithm for bigger datasets, > 5k images
+            if self.__chunksize == None:
+                self.__chunksize = round(1000000 / group_size)
+                if self.__chunksize < 1:
+                    self.__chunksize = 1
+            start = perf_counter()
+            for output in pool.imap_unordered(self._find_matches_batch, comparison_groups, self.__chunksize):
+                # if matches found, add to result
+                result_raw.extend(self._add_chunk_output(output))
+                count += 1
+                if self.__show_progress and progress_bar and count < n_groups:
+                    _help._progress_bar(count, n_groups, task=f'searching files')
+            if self.__show_progress and progress_bar:
+                _help._progress_bar(1, 1, task=f'searching files')
+            # pair generation is interleaved with the comparison in this algorithm
+            self._add_stage_time('compare', perf_counter() - start)
+
+        return result_raw
+
+    def _collapse_ids(self, ids, difpy_obj):
+        # Function that groups image IDs by identical tensors (and dimensions if same_dim, or aspect ratios if aspect_tolerance), the first image of a group represents it
+        groups = dict()
+        representatives = dict()
+        for img_id in ids:
+            key = hashlib.blake2b(difpy_obj._tensor_dictionary[img_id].tobytes(), digest_size=16).digest()
+            if self.__same_dim:
+                key = (key, tuple(sorted(difpy_obj._id_to_shape_dictionary[img_id])))
+            elif self.__aspect_tolerance is not None:
+                key = (key, _compare_imgs._aspect_ratio(difpy_obj._id_to_shape_dictionary[img_id]))
+            representative = representatives.setdefault(key, img_id)
+            groups.setdefault(representative, []).append(img_id)
+        return groups
+
+    def _yield_reverse_comparison_group(self, groups, positions, band=None):
+        # Yields the pairs of representatives that are also compared in reverse order, because an image of the group of the
+        # second representative precedes an image of the group of the first, and the MSE depends on the order of the images
+        active = []
+        for representative, members in groups.items():
+            position = positions[representative]
+            active = [(id_B, last) for id_B, last in active if last > position]
+            group = [(representative, id_B) for id_B, last in active if band is None or band.contains(representative, id_B)]
+            if len(group) > 0:
+                yield group
+            if len(members) > 1:
+                active.append((representative, positions[members[-1]]))
+
+    def _expand_matches(self, result_raw, groups_A, groups_B, positions=None):
+        # Function that expands the matches of the representatives to all images of their groups
+        # and sorts them in the order the image pairs would have been compared in
+        expanded = []
+        if positions is None:
+            # matches between two repositories
+            positions_A = {img_id : i for i, members in enumerate(groups_A.values()) for img_id in members}
+            positions_B = {img_id : i for i, members in enumerate(groups_B.values()) for img_id in members}
+            for id_A, id_B, mse in result_raw:
+                for img_A in groups_A[id_A]:
+                    for img_B in groups_B[id_B]:
+                        expanded.append(((positions_A[img_A], positions_B[img_B]), (img_A, img_B, mse)))
+        else:
+            for id_A, id_B, mse in result_raw:
+                for img_A in groups_A[id_A]:
+                    for img_B in groups_A[id_B]:
+                        if positions[img_A] < positions[img_B]:
+                            expanded.append(((positions[img_A], positions[img_B]), (img_A, img_B, mse)))
+            # images within a group are exact duplicates
+            for members in groups_A.values():
+                for i, img_A in enumerate(members):
+                    for img_B in members[i+1:]:
+                        expanded.append(((positions[img_A], positions[img_B]), (img_A, img_B, 0.0)))
+        expanded.sort(key=lambda match: match[0])
+        return [match for order, match in expanded]
+
+    def _add_chunk_output(self, output):
+        # Helper function that records the performance metrics of a compared chunk and returns its matches
+        n_pairs, n_pruned, result, usage = output
+        self.__perf['pairs']['compared'] += n_pairs - n_pruned
+        self.__perf['pairs']['pruned'] += n_pruned
+        self.__compared_pairs += n_pairs
+        _help._add_worker_usage(self.__perf['workers'], usage)
+        self.__progress.update(done=n_pairs, pairs_compared=n_pairs, matches_found=len(result))
+        return result
+
+    def _timed(self, stage, function, *args):
+        # Helper function that runs a stage of the search and records its duration
+        # reporting the stage also lets the callback stop the search between stages
+        self.__progress.stage(stage)
+        start = perf_counter()
+        output = function(*args)
+        self._add_stage_time(stage, perf_counter() - start)
+        return output
+
+    def _add_stage_time(self, stage, seconds):
+        # Helper function that adds the duration of a stage to the performance metrics
+        self.__perf['stages'][stage] = self.__perf['stages'].get(stage, 0) + seconds
+
     def _get_paths_from_groups(self):
         # Helper function to map group IDs to their parent folder paths
         folder_paths = {}
@@ -404,18 +947,13 @@ class search:
             # replace the key with the corresponding value from dict2
             new_key = self.__difpy_obj._filename_dictionary.get(key, key)
             # replace the values in the inner lists with corresponding values from dict2
-            new_value = [[self.__difpy_obj._filename_dictionary.get(inner[0], inner[0]), inner[1]] for inner in value]
+            new_value = [[self.__compare_obj._filename_dictionary.get(inner[0], inner[0]), inner[1]] for inner in value]
             # update the new dictionary
             updated_result[new_key] = new_value
         return updated_result
 
     def _format_result_infolder(self, result):
-        # Helper function that replaces the group IDs and image IDs in the result dictionary by their filepaths
-        # Replace group names
-        folder_paths = self._get_paths_from_groups()
-        result = self._group_result_infolder(result, folder_paths)
-
-        # Replace filenames
+        # Helper function that replaces the image IDs in the grouped result dictionary by their filepaths
         updated_result = dict()
         for group_id in result.keys():
             for key, value in result[group_id].items():
@@ -429,55 +967,75 @@ class search:
                 updated_result[group_id][new_key] = new_value
         return updated_result
 
-    def _find_matches(self, ids):
-        # Function that searches for a match between two images
-        id_A = ids[0]
-        id_B = ids[1]
-        tensor_A = self.__difpy_obj._tensor_dictionary[id_A]
-        tensor_B = self.__difpy_obj._tensor_dictionary[id_B] 
-        tensor_shape_A = self.__difpy_obj._id_to_shape_dictionary[id_A]
-        tensor_shape_B = self.__difpy_obj._id_to_shape_dictionary[id_B]
+    def _find_matches(self, id_combinations):
+        # Function that searches for matches among a batch of image pairs
+        tensor_A_list = np.stack([self.__difpy_obj._tensor_dictionary[id_A] for id_A, id_B in id_combinations])
+        tensor_B_list = np.stack([self.__compare_obj._tensor_dictionary[id_B] for id_A, id_B in id_combinations])
+        # check if two tensors are equal, MSE will always be 0
+        equals = _compare_imgs._check_equality(tensor_A_list, tensor_B_list)
+        # compute the MSE of the others
+        mses = np.zeros(len(id_combinations))
+        non_equal = np.where(~equals)[0]
+        mses[non_equal] = _compare_imgs._compute_mse_batch(tensor_A_list[non_equal], tensor_B_list[non_equal], rotate=self.__rotate, threshold=self.__similarity)
+        result = list()
+        for (id_A, id_B), equal, mse in zip(id_combinations, equals, mses):
+            if equal:
+                result.append((id_A, id_B, 0.0))
+            elif mse <= self.__similarity:
+                result.append((id_A, id_B, mse))
+        return result
 
-        if self.__same_dim:
-            # check if two tensors have the same dimensions
-            if _compare_imgs._compare_shape(tensor_shape_A, tensor_shape_B): 
-                # check if two tensors are equal
-                if _compare_imgs._check_equality(tensor_A, tensor_B):
-                    return (id_A, id_B, 0.0) # MSE will always be 0
-                else:
-                    # compute the MSE
-                    mse = _compare_imgs._compute_mse(tensor_A, tensor_B, rotate=self.__rotate)
-                    if mse <= self.__similarity:
-                        return (id_A, id_B, mse)
-            else:
-                return False
-        else:
-            # check if two tensors are equal
-            if _compare_imgs._check_equality(tensor_A, tensor_B):
-                return (id_A, id_B, 0.0) # MSE will always be 0
-            else:
-                # compute the MSE
-                mse = _compare_imgs._compute_mse(tensor_A, tensor_B, rotate=self.__rotate)
-                if mse <= self.__similarity:
-                    return (id_A, id_B, mse)            
+    def _find_matches_chunk(self, id_combinations):
+        # Function that searches for matches among a chunk of image pairs
+        if self.__profile is not None:
+            return _help._profiled(self.__profile, 'search', self._find_matches_chunk_unprofiled, id_combinations)
+        return self._find_matches_chunk_unprofiled(id_combinations)
+
+    def _find_matches_chunk_unprofiled(self, id_combinations):
+        # Function that searches for matches among a chunk of image pairs
+        result = list()
+        n_pruned = 0
+        for start in range(0, len(id_combinations), 1024):
+            batch = id_combinations[start:start+1024]
+            if self.__same_dim:
+                # check if two tensors have the same dimensions, pairs with different dimensions are skipped
+                same_shape = [_compare_imgs._compare_shape(self.__difpy_obj._id_to_shape_dictionary[id_A], self.__compare_obj._id_to_shape_dictionary[id_B]) for id_A, id_B in batch]
+                n_pruned += len(batch) - sum(same_shape)
+                batch = [ids for ids, same in zip(batch, same_shape) if same]
+            if len(batch) > 0:
+                result.extend(self._find_matches(batch))
+        return len(id_combinations), n_pruned, result, _help._worker_usage()
 
     def _find_matches_batch(self, ids):
+        # Function that searches for matches among images in batches
+        if self.__profile is not None:
+            return _help._profiled(self.__profile, 'search', self._find_matches_batch_unprofiled, ids)
+        return self._find_matches_batch_unprofiled(ids)
+
+    def _find_matches_batch_unprofiled(self, ids):
         # Function that searches for matches among images in batches
         result = list()
         id_A = ids[0][0]
         tensor_A = self.__difpy_obj._tensor_dictionary[id_A]
         ids_B_list = np.asarray([x[1] for x in ids])
-        tensor_B_list = np.asarray([self.__difpy_obj._tensor_dictionary[x[1]] for x in ids])
+        stacked, rows = self._get_stacked()
+        index = np.asarray([rows[x[1]] for x in ids])
+        if np.all(np.diff(index) == 1):
+            # the images of a group are usually consecutive in the stacked array, so no copy is needed
+            tensor_B_list = stacked[index[0]:index[-1]+1]
+        else:
+            tensor_B_list = stacked[index]
 
         if self.__same_dim:
             # compare only those that have the same shape
             shape_A_list = [sorted(self.__difpy_obj._id_to_shape_dictionary[id_A])]*len(ids)
-            shape_B_list = [sorted(self.__difpy_obj._id_to_shape_dictionary[id_B]) for id_B in ids_B_list]
+            shape_B_list = [sorted(self.__compare_obj._id_to_shape_dictionary[id_B]) for id_B in ids_B_list]
             same_shape = np.equal(shape_A_list, shape_B_list).all(axis=1)
             shape_index = np.where(same_shape)
             if len(shape_index) > 0:
                 ids_B_list = ids_B_list[shape_index]
                 tensor_B_list = tensor_B_list[shape_index]
+        n_pruned = len(ids) - len(ids_B_list)
             
         # check for exact matches among img A and imgs B
         sum_B_list = [np.sum(tensor_B) for tensor_B in tensor_B_list]
@@ -490,43 +1048,56 @@ class search:
         # append duplicates to result
         if len(dupl_index) > 0:
             for id_B in ids_B_list[dupl_index]:
-                result.append((id_A, id_B, 0))
+                result.append((id_A, id_B, 0.0))
             tensor_B_list = tensor_B_list[non_dupl_index]
             ids_B_list = ids_B_list[non_dupl_index]       
 
         if self.__similarity > 0:
             # for the remaining images, compute MSE for reach rotation
-            mses = np.asarray([_compare_imgs._compute_mse(tensor_A, tensor_B, 
-                                                            rotate=self.__rotate) for tensor_B in tensor_B_list])
+            mses = _compare_imgs._compute_mse_batch(tensor_A, tensor_B_list, rotate=self.__rotate, threshold=self.__similarity)
             mse_index_sim = np.where(mses <= self.__similarity)
-            if len(mse_index_sim) > 0:
-                i = 0
-                # append to result
-                for id_B in ids_B_list[mse_index_sim]:
-                    result.append((id_A, id_B, mses[i]))
-                    i+=1                   
-
-        return result
-
-    def _add_to_result(self, result_raw, output):
-        # Appends output to result
-        result_raw.append(output)
-        return result_raw
-
-    def _yield_comparison_group(self):
-        # Yields a list of images ready for comparison
-
-        # The old code assumed a contiguous list of file IDs.
-        max_value = max(self.__difpy_obj._tensor_dictionary.keys())
-        missing_ids = list(
-            set(range(max_value+1)).difference(
-                set(self.__difpy_obj._tensor_dictionary.keys())
-            )
-        )
-        for i in range(max_value):
-            if i in missing_ids:
-                continue
-            group = [(i, j) for j in filter(lambda x: x not in missing_ids, range(i+1, max_value))]
+            # append to result
+            for id_B, mse in zip(ids_B_list[mse_index_sim], mses[mse_index_sim]):
+                result.append((id_A, id_B, mse))
+
+        return len(ids), n_pruned, result, _help._worker_usage()
+
+    def _get_stacked(self):
+        # Function that stacks the tensors of the compared images once, so that all comparison groups of a worker share one array
+        ids, stacked, rows = self.__stacked
+        if stacked is None:
+            stacked = np.stack([self.__compare_obj._tensor_dictionary[img_id] for img_id in ids])
+            rows = {img_id : i for i, img_id in enumerate(ids)}
+            # point the repository to the stacked array, so that tensors are only held in memory once
+            for i, img_id in enumerate(ids):
+                self.__compare_obj._tensor_dictionary[img_id] = stacked[i]
+            self.__stacked = (ids, stacked, rows)
+        return stacked, rows
+
+    def __getstate__(self):
+        # the stacked array is built by every worker process itself instead of being sent along with the repository
+        state = self.__dict__.copy()
+        if state['_search__stacked'] is not None:
+            state.update({'_search__stacked' : (state['_search__stacked'][0], None, None)})
+        return state
+
+    def _yield_comparison_group(self, ids_A, ids_B=None, band=None):
+        # Yields a list of images ready for comparison: all following images among ids_A, or all images of ids_B
+        # if an aspect ratio band is given, only the images within the band of the image are yielded
+        for i, id_A in enumerate(ids_A):
+            if band is not None:
+                indices = band.indices(id_A, self.__difpy_obj)
+                if ids_B is None:
+                    indices = indices[indices > i]
+                    self.__perf['pairs']['pruned'] += len(ids_A) - i - 1 - len(indices)
+                    group = [(id_A, ids_A[j]) for j in indices]
+                else:
+                    self.__perf['pairs']['pruned'] += len(ids_B) - len(indices)
+                    group = [(id_A, ids_B[j]) for j in indices]
+            elif ids_B is None:
+                group = [(id_A, id_B) for id_B in ids_A[i+1:]]
+            else:
+                group = [(id_A, id_B) for id_B in ids_B]
             if len(group) != 0:
                 yield group
 
@@ -542,6 +1113,15 @@ class search:
         del already_added
         return result
 
+    def _group_result_against(self, tuple_list):
+        # Function that formats the final result dict when searching against another repository
+        # every image of difpy_obj keeps all of its matches, images that are in both repositories are not matched with themselves
+        result = defaultdict(list)
+        for k, *v in tuple_list:
+            if self.__difpy_obj._filename_dictionary[k] != self.__compare_obj._filename_dictionary[v[0]]:
+                result[k].append(v)
+        return dict(result)
+
     def _group_result_infolder(self, tuple_list, folder_paths):
         # Function that formats the final result dict using folder paths
         result = defaultdict(list)
@@ -561,11 +1141,11 @@ class search:
         del already_added
         return result
 
-    def _search_metadata_union(self, result):
+    def _search_metadata_union(self, result, similarity):
         # Helper function that compares image qualities and computes process metadata
         duplicate_count, similar_count = 0, 0
         lower_quality = np.array([])
-        if self.__similarity == 0:
+        if similarity == 0:
             for img in result.keys():
                 match_group = [img]
                 # count number of duplicates
@@ -574,9 +1154,9 @@ class search:
                     
                     match_group.append(img_matches[0])
                 # compare image quality
-                match_group = _compare_imgs._sort_imgs_by_size(match_group)
+                match_group = self._sort_match_group(match_group)
                 # group lower quality images
-                lower_quality = np.concatenate((lower_quality, match_group[1:]), axis = None)
+                lower_quality = self._add_lower_quality(lower_quality, match_group)
         else:
             for img in result.keys():
                 match_group = [img]
@@ -589,18 +1169,37 @@ class search:
                     else:
                         similar_count += 1    
                 # compare image quality
-                match_group = _compare_imgs._sort_imgs_by_size(match_group)
+                match_group = self._sort_match_group(match_group)
                 # group lower quality images
-                lower_quality = np.concatenate((lower_quality, match_group[1:]), axis = None)
+                lower_quality = self._add_lower_quality(lower_quality, match_group)
         
         lower_quality = list(set(lower_quality))
         return lower_quality, duplicate_count, similar_count    
 
-    def _search_metadata_infolder(self, result):
+    def _search_metadata_against(self, result):
+        # Helper function that ranks every image of difpy_obj against its matches in the compared repository and computes process metadata
+        # only images of difpy_obj can be lower quality: an image is lower quality unless it ranks higher than all of its matches
+        duplicate_count, similar_count = 0, 0
+        lower_quality = []
+        for img, matches in result.items():
+            duplicate_count += sum([1 for match in matches if match[1] == 0])
+            similar_count += sum([1 for match in matches if match[1] != 0])
+            best_match = max(matches, key=lambda match: self._img_quality(self.__compare_obj, match[0]))[0]
+            if self._img_quality(self.__compare_obj, best_match) >= self._img_quality(self.__difpy_obj, img):
+                file = self.__difpy_obj._filename_dictionary[img]
+                lower_quality.append(file)
+                self.__keep_dictionary.setdefault(str(file), str(self.__compare_obj._filename_dictionary[best_match]))
+        return lower_quality, duplicate_count, similar_count
+
+    def _img_quality(self, difpy_obj, img_id):
+        # Helper function that returns the quality of an image of a repository, see _compare_imgs._img_quality
+        return _compare_imgs._img_quality(difpy_obj._id_to_shape_dictionary[img_id], difpy_obj._id_to_meta_dictionary[img_id], rank_by=self.__rank_by)
+
+    def _search_metadata_infolder(self, result, similarity):
         # Helper function that compares image qualities and computes process metadata
         duplicate_count, similar_count = 0, 0
         lower_quality = np.array([])
-        if self.__similarity == 0:
+        if similarity == 0:
             for group_id in result.keys():
                 for img in result[group_id].keys():
                     match_group = [img]
@@ -609,9 +1208,9 @@ class search:
                     for img_matches in result[group_id][img]:
                         match_group.append(img_matches[0])
                     # compare image quality
-                    match_group = _compare_imgs._sort_imgs_by_size(match_group)
+                    match_group = self._sort_match_group(match_group)
                     # group lower quality images
-                    lower_quality = np.concatenate((lower_quality, match_group[1:]), axis = None)
+                    lower_quality = self._add_lower_quality(lower_quality, match_group)
         else:
             for group_id in result.keys():
                 for img in result[group_id].keys():
@@ -625,96 +1224,845 @@ class search:
                         else:
                             similar_count += 1    
                     # compare image quality
-                    match_group = _compare_imgs._sort_imgs_by_size(match_group)
+                    match_group = self._sort_match_group(match_group)
                     # group lower quality images
-                    lower_quality = np.concatenate((lower_quality, match_group[1:]), axis = None)
+                    lower_quality = self._add_lower_quality(lower_quality, match_group)
             
         lower_quality = list(set(lower_quality))
         return lower_quality, duplicate_count, similar_count  
     
-    def _delete_files(self):
-        deleted_files = 0
-
-        for file in self.lower_quality:
-            try:
-                os.remove(file)
-                deleted_files += 1
-            except:
-                warnings.warn(f'Could not delete file: {file}', stacklevel=2)
-
-        return deleted_files
-
-    def move_to(self, destination_path):
+    def _add_lower_quality(self, lower_quality, match_group):
+        # Helper function that groups the lower quality images of a sorted match group and records the image they are matched with
+        for img in match_group[1:]:
+            self.__keep_dictionary.setdefault(str(img), str(match_group[0]))
+        return np.concatenate((lower_quality, match_group[1:]), axis = None)
+
+    def _sort_match_group(self, match_group):
+        # Helper function that sorts a match group of image IDs by quality and returns their filenames, highest quality first
+        obj = self.__difpy_obj
+        imgs = [(obj._filename_dictionary[img_id], obj._id_to_shape_dictionary[img_id], obj._id_to_meta_dictionary[img_id]) for img_id in match_group]
+        return _compare_imgs._sort_imgs_by_quality(imgs, rank_by=self.__rank_by)
+
+    def _check_single_threshold(self, action):
+        # Function that checks that the lower quality images belong to a single similarity threshold
+        if self.__thresholds is not None:
+            raise Exception(f'"{action}" requires a search with a single "similarity" threshold. Please rerun difPy.search with the selected threshold.')
+
+    def _delete_files(self, hardlink=False, journal=None):
+        # Function that deletes the lower quality images, or replaces them by hardlinks to their highest quality match
+        if hardlink:
+            lower_quality = set([str(file) for file in self.lower_quality])
+            actions = [('hardlink', str(file), self._resolve_keep(str(file), lower_quality)) for file in self.lower_quality]
+        else:
+            actions = [('delete', str(file), None) for file in self.lower_quality]
+        done = _file_actions._run(actions, journal=journal)
+        return len(done)
+
+    def _resolve_keep(self, file, lower_quality):
+        # Function that returns the image a lower quality image is linked to, following the chain of kept images until an image that
+        # is not a lower quality image itself, so that the hardlinks do not depend on each other (f. e. A -> B of one group and B -> C of another)
+        seen = {file}
+        keep = self.__keep_dictionary.get(file, file)
+        while keep in lower_quality and keep not in seen:
+            seen.add(keep)
+            keep = self.__keep_dictionary.get(keep, keep)
+        return keep
+
+    def move_to(self, destination_path, journal=None):
         # Function for moving the lower quality images that were found after the search
         '''
         Parameters
         ----------
         destination_path : str
             Path to move the lower_quality files to
+        journal : str, optional
+            Path of a journal file the moved files are recorded to. Rerunning with the same journal resumes an interrupted run (default is None)
         '''
+        self._check_single_threshold('move_to')
         destination_path = _validate_param._move_to(destination_path)
-        new_lower_quality = []
+        journal = _validate_param._journal(journal)
+        actions, new_lower_quality = [], []
+        to_move = []
         for file in self.lower_quality:
-            try:
-                head, tail = os.path.split(file)
-                os.replace(file, os.path.join(destination_path, tail))
-                new_lower_quality = np.append(new_lower_quality, str(Path(os.path.join(destination_path, tail))))
-            except:
-                warnings.warn(f'Could not move file: {file}', stacklevel=2)          
-        print(f'Moved {len(self.lower_quality)} files(s) to "{str(Path(destination_path))}"')
-        self.lower_quality = new_lower_quality
+            head, tail = os.path.split(file)
+            dst = str(Path(os.path.join(destination_path, tail)))
+            if os.path.abspath(file) == os.path.abspath(dst):
+                # file is already in the destination directory
+                new_lower_quality.append(dst)
+            else:
+                to_move.append(str(file))
+        used = set([os.path.normcase(os.path.basename(file)) for file in new_lower_quality])
+        # sorted, so that a resumed run assigns the same destination names as the interrupted one
+        for file in sorted(to_move):
+            actions.append(('move', file, _file_actions._unique_dst(destination_path, os.path.basename(file), used)))
+        done = _file_actions._run(actions, journal=journal)
+        print(f'Moved {len(done)} files(s) to "{str(Path(destination_path))}"')
+        self._rename_files({src : dst for action, src, dst in done})
+        self.lower_quality = new_lower_quality + [dst for action, src, dst in done]
         return  
 
-    def delete(self, silent_del=False):
+    def delete(self, silent_del=False, hardlink=False, journal=None):
         # Function for deleting the lower quality images that were found after the search
         '''
         Parameters
         ----------
         silent_del : bool, optional
             Skip user confirmation when delete=True (default is False)
+        hardlink : bool, optional
+            Replace the lower quality images by hardlinks to their highest quality match instead of deleting them (default is False)
+        journal : str, optional
+            Path of a journal file the deleted files are recorded to. Rerunning with the same journal resumes an interrupted run (default is None)
         '''
+        self._check_single_threshold('delete')
         silent_del = _validate_param._silent_del(silent_del)
+        hardlink = _validate_param._hardlink(hardlink)
+        journal = _validate_param._journal(journal)
+        deleted_files = 0
         
         if len(self.lower_quality) > 0:
             if not silent_del:
-                usr = input('Are you sure you want to delete all lower quality matched images? \n! This cannot be undone. (y/n)')
+                if hardlink:
+                    usr = input('Are you sure you want to replace all lower quality matched images by hardlinks? (y/n)')
+                else:
+                    usr = input('Are you sure you want to delete all lower quality matched images? \n! This cannot be undone. (y/n)')
                 if str(usr).lower() == 'y':
-                    deleted_files = self._delete_files()
+                    deleted_files = self._delete_files(hardlink=hardlink, journal=journal)
                 else:
                     print('Deletion canceled.')
                     return
             else:
-                deleted_files = self._delete_files()
+                deleted_files = self._delete_files(hardlink=hardlink, journal=journal)
+
+        if hardlink:
+            print(f'Replaced {deleted_files} file(s) by hardlinks')
+        else:
+            print(f'Deleted {deleted_files} file(s)')
+
+        return
+
+    def undo(self, journal):
+        # Function for undoing the file actions recorded in a journal
+        '''
+        Parameters
+        ----------
+        journal : str
+            Path of the journal file written by move_to or delete
+        '''
+        self._check_single_threshold('undo')
+        journal = _validate_param._journal(journal)
+        if journal is None or not os.path.isfile(journal):
+            raise FileNotFoundError(f'Journal "{journal}" does not exist')
+        undone = _file_actions._undo(journal)
+        print(f'Restored {len(undone)} file(s)')
+        moved_back = {dst : src for action, src, dst in undone if action == 'move'}
+        self._rename_files(moved_back)
+        self.lower_quality = [moved_back.get(str(file), file) for file in self.lower_quality]
+        return
+
+    def _rename_files(self, renamed):
+        # Helper function that updates the matched images of the lower quality images after they were moved
+        self.__keep_dictionary = {renamed.get(file, file) : renamed.get(keep, keep) for file, keep in self.__keep_dictionary.items()}
+
+def query(archive, incoming, **kwargs):
+    '''
+    Searches for matches of the images of a new difPy image repository in an existing one, only comparing the pairs between both repositories
+
+    Parameters
+    ----------
+    archive : difPy.dif.build
+        difPy object containing the existing build image repository
+    incoming : difPy.dif.build
+        difPy object containing the new build image repository, its images are the keys of the search result
+    kwargs
+        Parameters of difPy.search
+
+    Returns
+    -------
+    difPy.dif.search
+        search object of the images of incoming against archive, see difPy.search(incoming, against=archive)
+    '''
+    return search(incoming, against=archive, **kwargs)
+
+async def build_async(*directory, callback=None, **kwargs):
+    '''
+    Coroutine that builds a difPy image repository without blocking the event loop
+
+    Parameters
+    ----------
+    directory : str, list
+        Paths of the directories or the files to be searched
+    callback : callable (optional)
+        Function that is called with a dictionary of progress metrics while building, from the thread difPy runs in (default is None)
+    kwargs
+        Parameters of difPy.build
+    '''
+    return await _help._run_async(build, *directory, callback=callback, **kwargs)
+
+class search_async:
+    '''
+    A class used to search for matches in a difPy image repository without blocking the event loop
+    '''
+    def __init__(self, difpy_obj, callback=None, **kwargs):
+        '''
+        Parameters
+        ----------
+        difPy_obj : difPy.dif.build
+            difPy object containing the build image repository
+        callback : callable (optional)
+            Function that is called with a dictionary of progress metrics while searching, from the thread difPy runs in (default is None)
+        kwargs
+            Parameters of difPy.search
+        '''
+        self.__difpy_obj = difpy_obj
+        self.__callback = callback
+        self.__kwargs = kwargs
+        self.__search = None
+
+    def __await__(self):
+        # awaiting the search returns the difPy.search object
+        return self._run().__await__()
+
+    async def __aiter__(self):
+        # iterating over the search yields the items of search.result
+        se = await self._run()
+        for item in se.result.items():
+            yield item
+
+    async def _run(self):
+        # Function that runs the search once, in a thread
+        if self.__search is None:
+            self.__search = await _help._run_async(search, self.__difpy_obj, callback=self.__callback, **self.__kwargs)
+        return self.__search
+
+class serve:
+    '''
+    A class used to keep a difPy image repository in memory and serve match queries over a local HTTP server
+    '''
+    def __init__(self, difpy_obj, host='127.0.0.1', port=8765, similarity='duplicates', rotate=True, same_dim=True, show_progress=True, **kwargs):
+        '''
+        Parameters
+        ----------
+        difPy_obj : difPy.dif.build
+            difPy object containing the build image repository to be kept in memory
+        host : str (optional)
+            Host address the server binds to (default is '127.0.0.1')
+        port : int (optional)
+            Port the server listens on (default is 8765)
+        similarity : 'duplicates', 'similar', float (optional)
+            Default image comparison similarity threshold (mse) for queries (default is 'duplicates', 0)
+        rotate : bool (optional)
+            Rotates images on comparison (default is True)
+        same_dim : bool (optional)
+            Only searches for duplicate/similar images that have the same dimensions (width x height in pixels) (default is True)
+        show_progress : bool (optional)
+            Show the difPy server logs in console (default is True)
+        '''
+        # Validate input parameters
+        self.__difpy_obj = _validate_param._serve_obj(difpy_obj)
+        self.__host = _validate_param._host(host)
+        self.__port = _validate_param._port(port)
+        self.__similarity = _validate_param._similarity(similarity)
+        self.__rotate = _validate_param._rotate(rotate)
+        self.__same_dim = _validate_param._same_dim(same_dim, self.__similarity)
+        self.__show_progress = _validate_param._show_progress(show_progress)
+        _validate_param._kwargs(kwargs)
+
+        # reverse index of the repository for removals
+        self.__id_by_filename = {str(Path(file)) : img_id for img_id, file in self.__difpy_obj._filename_dictionary.items()}
+        self.__next_id = max(self.__difpy_obj._filename_dictionary.keys(), default=-1) + 1
+        self.__stacked = None
+        # requests are handled in parallel threads, the repository is only read and changed while holding the lock
+        self.__lock = threading.RLock()
+
+        self._main()
+        return
+
+    def _main(self):
+        # Function that runs the server until interrupted
+        server = ThreadingHTTPServer((self.__host, self.__port), _serve_handler)
+        server._difpy_serve = self
+        server._difpy_show_progress = self.__show_progress
+        if self.__show_progress:
+            print(f'difPy serving {len(self.__id_by_filename)} images on http://{self.__host}:{server.server_port}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
+
+    def _get_files(self, paths):
+        # Function that expands the requested paths into image files
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                files.extend([f for f in glob(str(path) + '/**/*', recursive=True) if not os.path.isdir(f)])
+            elif os.path.isfile(path):
+                files.append(path)
+        valid_files, skip_files = self.__difpy_obj._validate_files(files)
+        invalid_files = {str(Path(file)) : 'Unsupported file type' for file in skip_files}
+        return valid_files, invalid_files
+
+    def _generate_tensors(self, files):
+        # Function that generates the tensors of the requested files in-process
+        tensors, invalid_files = [], dict()
+        with _decode_warnings():
+            for num, file in enumerate(files):
+                output = self.__difpy_obj._generate_tensor(num, file)
+                if isinstance(output, dict):
+                    invalid_files.update(output)
+                else:
+                    tensors.append((str(Path(file)), output[1], output[2], output[3]))
+        return tensors, invalid_files
+
+    def add(self, paths):
+        # Function that adds images to the in-memory repository
+        valid_files, invalid_files = self._get_files(paths)
+        tensors, decode_errors = self._generate_tensors(valid_files)
+        invalid_files.update(decode_errors)
+        added = self._add_tensors(tensors)
+        return {'added' : added, 'invalid_files' : invalid_files}
+
+    def _add_tensors(self, tensors):
+        # Function that adds generated tensors to the in-memory repository
+        added = 0
+        with self.__lock:
+            for file, tensor, shape, meta in tensors:
+                if file in self.__id_by_filename:
+                    # replace the existing entry of a file that was added before
+                    self.remove([file])
+                img_id = self.__next_id
+                self.__difpy_obj._tensor_dictionary.update({img_id : tensor})
+                self.__difpy_obj._id_to_shape_dictionary.update({img_id : shape})
+                self.__difpy_obj._id_to_meta_dictionary.update({img_id : meta})
+                self.__difpy_obj._filename_dictionary.update({img_id : file})
+                self.__id_by_filename.update({file : img_id})
+                self.__next_id += 1
+                added += 1
+            if added > 0:
+                self.__stacked = None
+        return added
+
+    def remove(self, paths):
+        # Function that removes images from the in-memory repository
+        removed = 0
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                files.extend(glob(str(path) + '/**/*', recursive=True))
+            else:
+                files.append(path)
+        with self.__lock:
+            for file in files:
+                img_id = self.__id_by_filename.pop(str(Path(file)), None)
+                if img_id is not None:
+                    del self.__difpy_obj._tensor_dictionary[img_id]
+                    del self.__difpy_obj._id_to_shape_dictionary[img_id]
+                    del self.__difpy_obj._id_to_meta_dictionary[img_id]
+                    del self.__difpy_obj._filename_dictionary[img_id]
+                    removed += 1
+            if removed > 0:
+                self.__stacked = None
+        return {'removed' : removed}
+
+    def query(self, paths, similarity=None, add=False):
+        # Function that searches for matches of the requested images in the in-memory repository
+        similarity = self.__similarity if similarity is None else _validate_param._similarity(similarity)
+        valid_files, invalid_files = self._get_files(paths)
+        tensors, decode_errors = self._generate_tensors(valid_files)
+        invalid_files.update(decode_errors)
+        result = dict()
+        with self.__lock:
+            ids, stacked, shapes = self._get_stacked()
+            for file, tensor, shape, meta in tensors:
+                matches = []
+                index = np.arange(len(ids))
+                if self.__same_dim and len(index) > 0:
+                    index = index[(shapes == sorted(shape)).all(axis=1)]
+                if len(index) > 0:
+                    mses = _compare_imgs._compute_mse_batch(tensor, stacked[index], rotate=self.__rotate, threshold=similarity)
+                    equals = (stacked[index] == tensor).reshape(len(index), -1).all(axis=1)
+                    mses[equals] = 0.0
+                    for i in np.argsort(mses, kind='stable'):
+                        if mses[i] > similarity:
+                            break
+                        match_file = self.__difpy_obj._filename_dictionary[ids[index[i]]]
+                        if match_file != file:
+                            matches.append([match_file, float(mses[i])])
+                result.update({file : matches})
+            if add:
+                # the tensors of the query are added as they are, the images are not decoded a second time
+                self._add_tensors(tensors)
+        return {'result' : result, 'invalid_files' : invalid_files}
+
+    def stats(self):
+        # Function that returns the state of the in-memory repository
+        with self.__lock:
+            total_files = len(self.__id_by_filename)
+        return {'total_files' : total_files,
+                'parameters' : {'similarity_mse' : self.__similarity, 'rotate' : self.__rotate, 'same_dim' : self.__same_dim,
+                                'px_size' : self.__difpy_obj.stats['process']['build']['parameters']['px_size'],
+                                'features' : self.__difpy_obj.stats['process']['build']['parameters']['features']}}
+
+    def _get_stacked(self):
+        # Function that stacks the repository tensors into one array for vectorized comparison
+        if self.__stacked is None:
+            ids = np.asarray(list(self.__difpy_obj._tensor_dictionary.keys()), dtype=int)
+            if len(ids) > 0:
+                stacked = np.stack([self.__difpy_obj._tensor_dictionary[img_id] for img_id in ids])
+                shapes = np.asarray([sorted(self.__difpy_obj._id_to_shape_dictionary[img_id]) for img_id in ids])
+                # point the repository to the stacked array, so that tensors are only held in memory once
+                for i, img_id in enumerate(ids):
+                    self.__difpy_obj._tensor_dictionary[img_id] = stacked[i]
+            else:
+                stacked, shapes = None, None
+            self.__stacked = (ids, stacked, shapes)
+        return self.__stacked
+
+class _serve_handler(BaseHTTPRequestHandler):
+    '''
+    A class handling the HTTP requests of the difPy server
+    '''
+    def do_GET(self):
+        if self.path == '/stats':
+            self._respond(200, self.server._difpy_serve.stats())
+        else:
+            self._respond(404, {'error' : f'Unknown endpoint "{self.path}"'})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+            files = body.get('files', [])
+            if isinstance(files, str):
+                files = [files]
+            if self.path == '/add':
+                response = self.server._difpy_serve.add(files)
+            elif self.path == '/remove':
+                response = self.server._difpy_serve.remove(files)
+            elif self.path == '/query':
+                response = self.server._difpy_serve.query(files, similarity=body.get('similarity'), add=bool(body.get('add', False)))
+            else:
+                self._respond(404, {'error' : f'Unknown endpoint "{self.path}"'})
+                return
+            self._respond(200, response)
+        except Exception as e:
+            self._respond(400, {'error' : f'{e.__class__.__name__}: {e}'})
+
+    def _respond(self, code, response):
+        # Function that sends a JSON response
+        data = json.dumps(response, default=str).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server._difpy_show_progress:
+            super().log_message(format, *args)
+
+class _file_actions:
+    '''
+    A class for running file actions on the lower quality images in parallel, recorded in an append-only journal
+    '''
+    def _run(actions, journal=None):
+        # Function that runs a list of (action, src, dst) file actions on a thread pool
+        done = []
+        # skip the actions recorded as done in the journal of a previous run
+        if journal is not None:
+            journaled = _file_actions._read_journal(journal)
+            done = [entry for entry in actions if entry in journaled]
+            actions = [entry for entry in actions if entry not in journaled]
+        if len(actions) == 0:
+            return done
+
+        journal_file = _file_actions._open_journal(journal) if journal is not None else None
+        try:
+            with ThreadPoolExecutor() as executor:
+                futures = {executor.submit(_file_actions._do, *entry) : entry for entry in actions}
+                for future in as_completed(futures):
+                    action, src, dst = futures[future]
+                    try:
+                        future.result()
+                    except Exception as e:
+                        warnings.warn(f'Could not {action} file: {src} -> {e}', stacklevel=3)
+                        continue
+                    done.append((action, src, dst))
+                    if journal_file is not None:
+                        journal_file.write(json.dumps({'action' : action, 'src' : src, 'dst' : dst}) + '\n')
+                        journal_file.flush()
+        finally:
+            if journal_file is not None:
+                journal_file.close()
+        return done
+
+    def _unique_dst(directory, name, used):
+        # Function that returns the destination path of a moved file, files with the same name get a numbered suffix (f. e. image_1.jpg)
+        stem, ext = os.path.splitext(name)
+        candidate, count = name, 0
+        while os.path.normcase(candidate) in used:
+            count += 1
+            candidate = f'{stem}_{count}{ext}'
+        used.add(os.path.normcase(candidate))
+        return str(Path(os.path.join(directory, candidate)))
+
+    def _do(action, src, dst):
+        # Function that performs a single file action
+        if action == 'move':
+            if not os.path.exists(src) and os.path.exists(dst):
+                # file was already moved by an interrupted run
+                return
+            if os.path.exists(dst):
+                # never overwrite a file that is not part of the search
+                raise FileExistsError(f'Destination "{dst}" already exists')
+            os.replace(src, dst)
+        elif action == 'delete':
+            os.remove(src)
+        elif action == 'hardlink':
+            if os.path.samefile(src, dst):
+                return
+            # link to a temporary file first, so that src is replaced atomically
+            tmp = f'{src}.difpy-link'
+            os.link(dst, tmp)
+            try:
+                os.replace(tmp, src)
+            except:
+                os.remove(tmp)
+                raise
+        elif action == 'unlink':
+            # replace a hardlink by an independent copy of the file
+            tmp = f'{src}.difpy-copy'
+            shutil.copy2(src, tmp)
+            os.replace(tmp, src)
+
+    def _open_journal(journal):
+        # Function that opens a journal for appending, and terminates a line that was only partially written by an interrupted run
+        file = open(journal, 'a+')
+        if file.tell() > 0:
+            file.seek(file.tell() - 1)
+            if file.read(1) != '\n':
+                file.write('\n')
+        return file
+
+    def _read_journal(journal):
+        # Function that reads the (action, src, dst) file actions recorded in a journal
+        journaled = set()
+        if os.path.isfile(journal):
+            with open(journal, 'r') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # skip a line that was only partially written by an interrupted run
+                        continue
+                    if entry['action'].startswith('undo_'):
+                        journaled.discard((entry['action'][len('undo_'):], entry['src'], entry['dst']))
+                    else:
+                        journaled.add((entry['action'], entry['src'], entry['dst']))
+        return journaled
+
+    def _undo(journal):
+        # Function that reverts the moves and hardlinks recorded in a journal, deleted files cannot be restored
+        reverts = dict()
+        for entry in _file_actions._read_journal(journal):
+            action, src, dst = entry
+            if action == 'move':
+                reverts.update({('move', dst, src) : entry})
+            elif action == 'hardlink':
+                reverts.update({('unlink', src, None) : entry})
+            else:
+                warnings.warn(f'Could not restore deleted file: {src}', stacklevel=3)
+        undone = [reverts[entry] for entry in _file_actions._run(list(reverts.keys()))]
+        with _file_actions._open_journal(journal) as file:
+            for action, src, dst in undone:
+                file.write(json.dumps({'action' : f'undo_{action}', 'src' : src, 'dst' : dst}) + '\n')
+        return undone
+
+class _output:
+    '''
+    A class for writing the search results to files in the CLI output formats
+    '''
+    def _write(se, dir, timestamp, output_format='json', compress=False):
+        # Function that writes the search result, lower_quality and stats to files and returns their filenames
+        files = []
+        if output_format == 'json':
+            # nested result dictionary and lower_quality list, as written by previous difPy versions
+            with _output._open(dir, f'difPy_{timestamp}_results.json', compress, files) as file:
+                json.dump(se.result, file)
+            with _output._open(dir, f'difPy_{timestamp}_lower_quality.txt', compress, files) as file:
+                file.write(f"{se.lower_quality}")
+        else:
+            if output_format == 'jsonl':
+                with _output._open(dir, f'difPy_{timestamp}_results.jsonl', compress, files) as file:
+                    for folder, img, match, mse in _output._edges(se.result):
+                        edge = {'file' : img, 'match' : match, 'mse' : float(mse)}
+                        if folder is not None:
+                            edge.update({'folder' : folder})
+                        file.write(json.dumps(edge) + '\n')
+            elif output_format == 'csv':
+                with _output._open(dir, f'difPy_{timestamp}_results.csv', compress, files) as file:
+                    writer = csv.writer(file)
+                    writer.writerow(['folder', 'file', 'match', 'mse'])
+                    for folder, img, match, mse in _output._edges(se.result):
+                        writer.writerow([folder if folder is not None else '', img, match, float(mse)])
+            elif output_format == 'npz':
+                _output._write_npz(se, dir, timestamp, compress, files)
+            # one lower quality image per line
+            with _output._open(dir, f'difPy_{timestamp}_lower_quality.txt', compress, files) as file:
+                for img in se.lower_quality:
+                    file.write(f'{img}\n')
+        with _output._open(dir, f'difPy_{timestamp}_stats.json', False, files) as file:
+            json.dump(se.stats, file)
+        return files
+
+    def _write_npz(se, dir, timestamp, compress, files):
+        # Function that writes the matches as arrays of integer file IDs and MSEs, and the array of filenames the IDs refer to
+        file_ids = dict()
+        folders, ids_A, ids_B, mses = [], [], [], []
+        for folder, img, match, mse in _output._edges(se.result):
+            for filename in [folder, img, match]:
+                # the ID of a file or folder is its index in the filenames array
+                if filename is not None:
+                    file_ids.setdefault(filename, len(file_ids))
+            # -1 when the result is not grouped by folder
+            folders.append(file_ids[folder] if folder is not None else -1)
+            ids_A.append(file_ids[img])
+            ids_B.append(file_ids[match])
+            mses.append(mse)
+        filename = f'difPy_{timestamp}_results.npz'
+        save = np.savez_compressed if compress else np.savez
+        # filenames are stored as a fixed-width string array, so that the archive can be loaded without allow_pickle
+        save(os.path.join(dir, filename), folder=np.asarray(folders, dtype=np.int64), id_A=np.asarray(ids_A, dtype=np.int64), id_B=np.asarray(ids_B, dtype=np.int64), mse=np.asarray(mses, dtype=np.float64),
+             lower_quality=np.asarray([file_ids[str(img)] for img in se.lower_quality], dtype=np.int64), files=np.asarray(list(file_ids.keys()), dtype=str))
+        files.append(filename)
+
+    def _edges(result):
+        # Function that yields the (folder, file, match, mse) edges of a search result
+        for key, value in result.items():
+            if isinstance(value, dict):
+                # result grouped by folder when in_folder is True
+                for img, matches in value.items():
+                    for match, mse in matches:
+                        yield key, img, match, mse
+            else:
+                for match, mse in value:
+                    yield None, key, match, mse
+
+    def _open(dir, filename, compress, files):
+        # Function that opens an output file for writing, gzip compressed if requested
+        if compress:
+            filename = f'{filename}.gz'
+        files.append(filename)
+        if compress:
+            return gzip.open(os.path.join(dir, filename), 'wt', newline='')
+        return open(os.path.join(dir, filename), 'w', newline='')
+
+class _progress:
+    '''
+    A class for reporting progress metrics of the difPy processes to a callback
+    '''
+    def __init__(self, callback, process, interval=0.5):
+        self.__callback = callback
+        self.__process = process
+        # minimum number of seconds between two reports
+        self.__interval = interval
+        self.__counters = dict()
+
+    def __getstate__(self):
+        # the callback is only called in the main process and might not be picklable
+        state = self.__dict__.copy()
+        state.update({'_progress__callback' : None})
+        return state
+
+    def stage(self, stage, total=None):
+        # Function that starts a new stage of the process
+        if self.__callback is None:
+            return
+        self.__stage = stage
+        self.__total = total
+        self.__done = 0
+        self.__stage_start = perf_counter()
+        self.__last_report = self.__stage_start
+        self._report(self.__stage_start)
+
+    def update(self, done=1, **counters):
+        # Function that updates the progress, only reports once per interval so that the hot loop is not slowed down
+        if self.__callback is None:
+            return
+        self.__done += done
+        for key, value in counters.items():
+            self.__counters[key] = self.__counters.get(key, 0) + value
+        now = perf_counter()
+        if now - self.__last_report >= self.__interval:
+            self._report(now)
+
+    def finish(self):
+        # Function that reports the end of the current stage
+        if self.__callback is None:
+            return
+        self._report(perf_counter())
+
+    def _report(self, now):
+        # Function that calls the callback with the current progress metrics
+        self.__last_report = now
+        elapsed = now - self.__stage_start
+        rate = self.__done / elapsed if elapsed > 0 else None
+        if self.__total is not None and rate:
+            eta = max(self.__total - self.__done, 0) / rate
+        else:
+            eta = None
+        event = {
+            'process' : self.__process,
+            'stage' : self.__stage,
+            'done' : self.__done,
+            'total' : self.__total,
+            'elapsed_seconds' : elapsed,
+            'items_per_second' : rate,
+            'eta_seconds' : eta,
+        }
+        event.update(self.__counters)
+        self.__callback(event)
 
-        print(f'Deleted {deleted_files} file(s)')
+class _aspect_band:
+    '''
+    A class used to find the images whose aspect ratios lie within a tolerance of an image
+    '''
+    def __init__(self, ids, difpy_obj, aspect_tolerance):
+        # images are sorted by the logarithm of their aspect ratio, so that the band has the same width for every image
+        self.__width = np.log1p(aspect_tolerance)
+        self.__keys = {img_id : np.log(_compare_imgs._aspect_ratio(difpy_obj._id_to_shape_dictionary[img_id])) for img_id in ids}
+        self.__order = np.argsort([self.__keys[img_id] for img_id in ids], kind='stable')
+        self.__sorted_keys = np.asarray([self.__keys[img_id] for img_id in ids])[self.__order]
+
+    def indices(self, img_id, difpy_obj):
+        # Function that returns the sorted indices of the images within the band of an image
+        key = np.log(_compare_imgs._aspect_ratio(difpy_obj._id_to_shape_dictionary[img_id]))
+        start = np.searchsorted(self.__sorted_keys, key - self.__width, side='left')
+        end = np.searchsorted(self.__sorted_keys, key + self.__width, side='right')
+        return np.sort(self.__order[start:end])
+
+    def contains(self, id_A, id_B):
+        # Function that checks if two images of the band are within the tolerance of each other
+        return abs(self.__keys[id_A] - self.__keys[id_B]) <= self.__width
+
+class _decode_warnings:
+    '''
+    A class used to handle the warnings raised while decoding an image as errors of this image
+    '''
+    # the warning filters are shared by all threads of a process and catch_warnings is not thread-safe, so the filters are
+    # only changed once while any build decodes images, and the warnings are recorded for the thread that raised them
+    _local = threading.local()
+    _lock = threading.Lock()
+    _users = 0
+    _catcher = None
+
+    def __enter__(self):
+        with _decode_warnings._lock:
+            if _decode_warnings._users == 0:
+                _decode_warnings._catcher = warnings.catch_warnings()
+                _decode_warnings._catcher.__enter__()
+                _decode_warnings._install()
+            _decode_warnings._users += 1
+        return self
+
+    def __exit__(self, *args):
+        with _decode_warnings._lock:
+            _decode_warnings._users -= 1
+            if _decode_warnings._users == 0:
+                _decode_warnings._catcher.__exit__(*args)
+                _decode_warnings._catcher = None
+
+    def _install():
+        # Function that records the decoding warnings of threads that decode an image, and shows those of other threads as before
+        showwarning = warnings.showwarning
+        def _showwarning(message, category, filename, lineno, file=None, line=None):
+            recorded = getattr(_decode_warnings._local, 'recorded', None)
+            if recorded is None:
+                showwarning(message, category, filename, lineno, file, line)
+            else:
+                recorded.append(message)
+        warnings.simplefilter('always', UserWarning)
+        warnings.simplefilter('always', Image.DecompressionBombWarning)
+        warnings.showwarning = _showwarning
+
+    def _start():
+        # Function that starts recording the warnings of the current thread
+        _decode_warnings._local.recorded = []
+
+    def _raise():
+        # Function that raises the first recorded warning of the current thread
+        recorded = getattr(_decode_warnings._local, 'recorded', None)
+        if recorded:
+            raise recorded[0]
+
+    def _stop():
+        # Function that stops recording the warnings of the current thread
+        _decode_warnings._local.recorded = None
+
+class _serial_pool:
+    '''
+    A class that runs the tasks of a pool in the current process, for inputs too small to pay off the startup of workers
+    '''
+    def __enter__(self):
+        return self
 
+    def __exit__(self, *args):
         return
 
+    def imap(self, function, iterable, chunksize=1):
+        # Function that lazily applies the function to the iterable, like Pool.imap
+        return map(function, iterable)
+
+    def imap_unordered(self, function, iterable, chunksize=1):
+        # Function that lazily applies the function to the iterable, like Pool.imap_unordered
+        return map(function, iterable)
+
 class _compare_imgs:
     '''
     A class for comparing images, used by the difpy algorithm
     '''    
-    def _compute_mse(tensor_A, tensor_B, rotate=True):
-        # Function that computes the mse between two tensors
-        if rotate:
-            mse_list = []
-            for rot in range(0, 3):
-                if rot == 0:
-                    # first rotation
-                    mse = np.square(np.subtract(tensor_A, tensor_B)).mean()
-                    mse_list.append(mse)
-                elif rot <= 3:
+    def _compute_mse_batch(tensor_A, tensor_B_list, rotate=True, threshold=np.inf, batch_size=1024, strips=8):
+        # Function that computes the mse between one tensor, or a stack of tensors pairwise, and a stack of tensors
+        # the squared error is accumulated in strips of rows, and a rotation is abandoned as soon as its partial mse exceeds
+        # the threshold or the smallest mse of the previous rotations. Abandoned pairs have an mse of inf
+        mses = np.full(len(tensor_B_list), np.inf)
+        if len(tensor_B_list) == 0:
+            return mses
+        n_values = tensor_B_list[0].size
+        n_rows = tensor_B_list.shape[1]
+        strip_rows = -(-n_rows // strips) if np.isfinite(threshold) else n_rows
+        pairwise = tensor_A.ndim == tensor_B_list.ndim
+        for start in range(0, len(tensor_B_list), batch_size):
+            tensor_B_batch = tensor_B_list[start:start+batch_size]
+            tensor_A_batch = tensor_A[start:start+batch_size] if pairwise else tensor_A[np.newaxis]
+            min_mse = np.full(len(tensor_B_batch), np.inf)
+            for rot in range(0, 3 if rotate else 1):
+                if rot > 0:
                     # all other rotations
-                    tensor_B = np.rot90(tensor_B)
-                    mse = np.square(np.subtract(tensor_A, tensor_B)).mean()
-                    mse_list.append(mse)
-            # return only the smallest MSE during the 4 rotations
-            min_mse = min(mse_list)  
-            return min_mse
-        else:
-            # compute MSE without rotating
-            mse = np.square(np.subtract(tensor_A, tensor_B)).mean()
-            return mse
+                    tensor_B_batch = np.rot90(tensor_B_batch, axes=(1, 2))
+                active = np.arange(len(tensor_B_batch))
+                squared_error = np.zeros(len(active), dtype=np.int64)
+                limit = np.minimum(min_mse, threshold)
+                for row in range(0, n_rows, strip_rows):
+                    if pairwise:
+                        tensor_A_strip = tensor_A_batch[active, row:row+strip_rows]
+                    else:
+                        tensor_A_strip = tensor_A_batch[:, row:row+strip_rows]
+                    strip = np.square(np.subtract(tensor_A_strip, tensor_B_batch[active, row:row+strip_rows]))
+                    squared_error += strip.reshape(len(active), -1).sum(axis=1, dtype=np.int64)
+                    # the squared error only grows, so pairs above the limit can be abandoned
+                    keep = squared_error / n_values <= limit[active]
+                    if not keep.all():
+                        active = active[keep]
+                        squared_error = squared_error[keep]
+                        if len(active) == 0:
+                            break
+                # return only the smallest MSE of the rotations
+                min_mse[active] = np.minimum(min_mse[active], squared_error / n_values)
+            mses[start:start+batch_size] = min_mse
+        return mses
 
     def _compare_shape(tensor_shape_A, tensor_shape_B):
         # Function that checks whether the dimensions of two tensors are equal
@@ -723,23 +2071,30 @@ class _compare_imgs:
         else:
             return False
 
-    def _check_equality(tensor_A, tensor_B):
-        # Function that checks whether two tensors are equal
-        if (tensor_A==tensor_B).all():
-            return True
-        else:
-            return False
+    def _aspect_ratio(shape):
+        # Function that returns the orientation-normalized aspect ratio of an image shape, always >= 1
+        return max(shape[0], shape[1]) / min(shape[0], shape[1])
+
+    def _check_equality(tensor_A_list, tensor_B_list):
+        # Function that checks pairwise whether the tensors of two stacks are equal
+        return (tensor_A_list == tensor_B_list).reshape(len(tensor_A_list), -1).all(axis=1)
         
-    def _sort_imgs_by_size(img_list):
-        # Function for sorting a list of images based on their file sizes
-        imgs_sizes = []
-        for img in img_list:
-            with Image.open(img) as image:
-                resolution = image.size
-            img_size = (sum(resolution), img)
-            imgs_sizes.append(img_size)
-        sort_by_size = [file for size, file in sorted(imgs_sizes, reverse=True)] # Highest first
-        return sort_by_size
+    def _img_quality(shape, meta, rank_by='resolution'):
+        # Function that returns the quality of an image from the metadata recorded during the build, higher is better
+        if rank_by == 'resolution':
+            return shape[0] + shape[1]
+        elif rank_by == 'filesize':
+            return meta['filesize']
+        elif rank_by == 'newest':
+            return meta['modified']
+        elif rank_by == 'oldest':
+            return -meta['modified']
+
+    def _sort_imgs_by_quality(img_list, rank_by='resolution'):
+        # Function for sorting a list of (filename, shape, metadata) images by their quality, using the metadata recorded during the build
+        imgs_quality = [(_compare_imgs._img_quality(shape, meta, rank_by=rank_by), img) for img, shape, meta in img_list]
+        sort_by_quality = [file for quality, file in sorted(imgs_quality, reverse=True)] # Highest first
+        return sort_by_quality
         
 class _generate_stats:
     '''
@@ -767,18 +2122,53 @@ class _generate_stats:
                         'end' : kwargs['end_time'].isoformat(),
                         'seconds_elapsed' : np.round((kwargs['end_time'] - kwargs['start_time']).total_seconds(), 4),
                     },
+                    'performance' : _generate_stats._build_performance(kwargs['performance']),
                     'parameters' : {
                         'recursive' : kwargs['recursive'],
                         'in_folder' : kwargs['in_folder'],
                         'limit_extensions' : kwargs['limit_extensions'],
                         'px_size' : kwargs['px_size'],
+                        'features' : kwargs['features'],
                         'processes' : kwargs['processes'],
+                        'executor' : kwargs['executor'],
                     }
                 }
             }
         }
         return build_stats
 
+    def _build_performance(performance):
+        # Function that generates the performance stats of the Build process
+        decode_seconds = sorted(performance['decode_seconds'], reverse=True)
+        seconds = np.asarray([s for s, file in decode_seconds])
+        return {
+            'stages_seconds' : {stage : np.round(s, 4) for stage, s in performance['stages'].items()},
+            'decode' : {
+                'files' : len(decode_seconds),
+                'seconds_total' : np.round(seconds.sum(), 4),
+                'seconds_percentiles' : {f'p{p}' : (np.round(np.percentile(seconds, p), 4) if len(seconds) > 0 else None) for p in [50, 90, 99, 100]},
+                'slowest_files' : [[file, np.round(s, 4)] for s, file in decode_seconds[:10]],
+                'bytes_read' : performance['bytes_read'],
+            },
+            'workers' : performance['workers'],
+            'executor' : performance['executor'],
+        }
+
+    def _search_performance(performance, profile):
+        # Function that generates the performance stats of the Search process
+        return {
+            'stages_seconds' : {stage : np.round(s, 4) for stage, s in performance['stages'].items()},
+            'pairs' : {
+                'total' : performance['pairs']['compared'] + performance['pairs']['pruned'],
+                'compared' : performance['pairs']['compared'],
+                'pruned' : performance['pairs']['pruned'],
+            },
+            'identical_images' : performance['identical_images'],
+            'workers' : performance['workers'],
+            'executor' : performance['executor'],
+            'profile' : profile,
+        }
+
     def search(**kwargs):
         # Function that generates stats for the Search process  
         search_stats = {
@@ -792,9 +2182,14 @@ class _generate_stats:
                     'similarity_mse' : kwargs['similarity'],
                     'rotate' : kwargs['rotate'],
                     'same_dim' : kwargs['same_dim'],
+                    'aspect_tolerance' : kwargs['aspect_tolerance'],
                     'processes' : kwargs['processes'],
-                    'chunksize' : kwargs['chunksize']
+                    'chunksize' : kwargs['chunksize'],
+                    'against' : kwargs['against'],
+                    'rank_by' : kwargs['rank_by'],
+                    'executor' : kwargs['executor']
                 },
+                'performance' : _generate_stats._search_performance(kwargs['performance'], kwargs['profile']),
                 'files_searched' : kwargs['files_searched'],
                 'matches_found' : {
                     'duplicates': kwargs['duplicate_count'],
@@ -851,8 +2246,12 @@ class _validate_param:
             raise Exception('Invalid value for "limit_extensions" parameter: must be of type BOOL.')
         return limit_extensions
 
-    def _similarity(similarity):
-        # Function that validates the 'similarity' input parameter
+    def _similarity(similarity, multiple=False):
+        # Function that validates the 'similarity' input parameter, a list of thresholds is only accepted if multiple
+        if isinstance(similarity, (list, tuple)) and multiple:
+            if len(similarity) == 0 or any(isinstance(threshold, (list, tuple)) for threshold in similarity):
+                raise Exception('Invalid value for "similarity" parameter: must be a non-empty LIST of "duplicates", "similar", INT or FLOAT values.')
+            return sorted(set([_validate_param._similarity(threshold) for threshold in similarity]))
         if similarity in ['low', 'normal', 'high']:
             raise Exception('Since difPy v3.0.8, "similarity" parameter only accepts "duplicates" and "similar" as input options.')  
         elif similarity not in ['duplicates', 'similar']: 
@@ -881,6 +2280,59 @@ class _validate_param:
             raise Exception('Invalid value for "px_size" parameter: must be between 10 and 5000.')
         return px_size
 
+    def _decode_timeout(decode_timeout):
+        # Function that validates the 'decode_timeout' input parameter
+        if decode_timeout is None:
+            return decode_timeout
+        if not isinstance(decode_timeout, (int, float)) or isinstance(decode_timeout, bool):
+            raise Exception('Invalid value for "decode_timeout" parameter: must be of type INT, FLOAT or None.')
+        if decode_timeout <= 0:
+            raise Exception('Invalid value for "decode_timeout" parameter: must be > 0.')
+        return decode_timeout
+
+    def _maxtasksperchild(maxtasksperchild):
+        # Function that validates the 'maxtasksperchild' input parameter
+        if maxtasksperchild is None:
+            return maxtasksperchild
+        if not isinstance(maxtasksperchild, int) or isinstance(maxtasksperchild, bool):
+            raise Exception('Invalid value for "maxtasksperchild" parameter: must be of type INT or None.')
+        if maxtasksperchild < 1:
+            raise Exception('Invalid value for "maxtasksperchild" parameter: must be >= 1.')
+        return maxtasksperchild
+
+    def _executor(executor, decode_timeout=None, maxtasksperchild=None, profile=None):
+        # Function that validates the 'executor' input parameter
+        if executor not in ['auto', 'process', 'thread', 'serial']:
+            raise Exception('Invalid value for "executor" parameter: must be "auto", "process", "thread" or "serial".')
+        if executor in ['thread', 'serial'] and (decode_timeout is not None or maxtasksperchild is not None):
+            raise ValueError('Invalid value for "executor" parameter: "decode_timeout" and "maxtasksperchild" require executor "auto" or "process".')
+        if executor == 'thread' and profile is not None:
+            # all threads of a process would share one profiler
+            raise ValueError('Invalid value for "executor" parameter: "profile" requires executor "auto", "process" or "serial".')
+        return executor
+
+    def _projected_processes(processes):
+        # Function that validates the 'processes' input parameter of difPy.plan, which can exceed the CPU cores of this machine
+        if not isinstance(processes, int):
+            raise Exception('Invalid value for "processes" parameter: must be of type INT.')
+        if processes < 1:
+            raise Exception('Invalid value for "processes" parameter: must be >= 1.')
+        return processes
+
+    def _sample_size(sample_size):
+        # Function that validates the 'sample_size' input parameter
+        if not isinstance(sample_size, int):
+            raise Exception('Invalid value for "sample_size" parameter: must be of type INT.')
+        if sample_size < 1:
+            raise Exception('Invalid value for "sample_size" parameter: must be >= 1.')
+        return sample_size
+
+    def _features(features):
+        # Function that validates the 'features' input parameter
+        if features not in ['rgb', 'gray']:
+            raise Exception('Invalid value for "features" parameter: must be "rgb" or "gray".')
+        return features
+
     def _rotate(rotate):
         # Function that validates the 'rotate' input parameter   
         if not isinstance(rotate, bool):
@@ -893,6 +2345,18 @@ class _validate_param:
             raise Exception('Invalid value for "same_dim" parameter: must be of type BOOL.')
         return same_dim
 
+    def _aspect_tolerance(aspect_tolerance, same_dim):
+        # Function that validates the 'aspect_tolerance' input parameter
+        if aspect_tolerance is None:
+            return aspect_tolerance
+        if not isinstance(aspect_tolerance, (int, float)) or isinstance(aspect_tolerance, bool):
+            raise Exception('Invalid value for "aspect_tolerance" parameter: must be of type INT, FLOAT or None.')
+        if aspect_tolerance < 0:
+            raise Exception('Invalid value for "aspect_tolerance" parameter: must be >= 0.')
+        if same_dim:
+            raise ValueError('Invalid value for "aspect_tolerance" parameter: only applies when "same_dim" is False.')
+        return aspect_tolerance
+
     def _show_progress(show_progress):
         # Function that validates the 'show_progress' input parameter
         if not isinstance(show_progress, bool):
@@ -918,6 +2382,44 @@ class _validate_param:
             raise Exception('Invalid value for "chunksize" parameter: must be >= 1.')
         return chunksize        
 
+    def _rank_by(rank_by):
+        # Function that validates the 'rank_by' input parameter
+        if rank_by not in ['resolution', 'filesize', 'newest', 'oldest']:
+            raise Exception('Invalid value for "rank_by" parameter: must be "resolution", "filesize", "newest" or "oldest".')
+        return rank_by
+
+    def _hardlink(hardlink):
+        # Function that validates the 'hardlink' input parameter
+        if not isinstance(hardlink, bool):
+            raise Exception('Invalid value for "hardlink" parameter: must be of type BOOL.')
+        return hardlink
+
+    def _journal(journal):
+        # Function that validates the 'journal' input parameter
+        if journal is None:
+            return journal
+        if not isinstance(journal, str):
+            raise Exception('Invalid value for "journal" parameter: must be of type STR or None.')
+        if os.path.isdir(journal):
+            raise ValueError(f'Invalid value for "journal" parameter: "{journal}" is a directory.')
+        return journal
+
+    def _callback(callback):
+        # Function that validates the 'callback' input parameter
+        if callback is not None and not callable(callback):
+            raise Exception('Invalid value for "callback" parameter: must be callable or None.')
+        return callback
+
+    def _profile(profile):
+        # Function that validates the 'profile' input parameter
+        if profile is None:
+            return profile
+        if not isinstance(profile, str):
+            raise Exception('Invalid value for "profile" parameter: must be of type STR or None.')
+        if os.path.exists(profile) and not os.path.isdir(profile):
+            raise ValueError(f'Invalid value for "profile" parameter: "{profile}" is not a directory.')
+        return profile
+
     def _silent_del(silent_del):
         # Function that _validates the 'delete' and the 'silent_del' input parameter
         if not isinstance(silent_del, bool):
@@ -939,6 +2441,40 @@ class _validate_param:
                 raise ValueError(f'Invalid value for "move_to" parameter: "{str(dir)}" is not a directory.')
         return dir 
 
+    def _against(against, difpy_obj):
+        # Function that validates the 'against' input parameter
+        if against is None:
+            return against
+        if not isinstance(against, build):
+            raise Exception('Invalid value for "against" parameter: must be a difPy.build object.')
+        if against.stats['process']['build']['parameters']['px_size'] != difpy_obj.stats['process']['build']['parameters']['px_size']:
+            raise ValueError('Invalid value for "against" parameter: both difPy.build objects must be built with the same "px_size".')
+        if against.stats['process']['build']['parameters']['features'] != difpy_obj.stats['process']['build']['parameters']['features']:
+            raise ValueError('Invalid value for "against" parameter: both difPy.build objects must be built with the same "features".')
+        return against
+
+    def _serve_obj(difpy_obj):
+        # Function that validates the 'difpy_obj' input parameter of the server
+        if not isinstance(difpy_obj, build):
+            raise Exception('Invalid value for "difpy_obj" parameter: must be a difPy.build object.')
+        if difpy_obj.stats['process']['build']['parameters']['in_folder']:
+            raise ValueError('Invalid value for "difpy_obj" parameter: difPy.build object must be built with "in_folder" set to False.')
+        return difpy_obj
+
+    def _host(host):
+        # Function that validates the 'host' input parameter
+        if not isinstance(host, str):
+            raise Exception('Invalid value for "host" parameter: must be of type STR.')
+        return host
+
+    def _port(port):
+        # Function that validates the 'port' input parameter
+        if not isinstance(port, int):
+            raise Exception('Invalid value for "port" parameter: must be of type INT.')
+        if port < 0 or port > 65535:
+            raise Exception('Invalid value for "port" parameter: must be between 0 and 65535.')
+        return port
+
     def _kwargs(kwargs):
         if "lazy" in kwargs:
             raise Exception('Parameter "-la" / "lazy" was renamed to "-dim" / "same_dim" with difPy v4.2. Please update your script.')
@@ -955,6 +2491,114 @@ class _help:
         else:
             print(f'difPy {task}: [{count/total_count:.0%}]', end='\r')
 
+    def _generate_tensor_args(args):
+        # Function that unpacks the (num, file, px_size, features) arguments of _generate_tensor and measures its duration
+        start = perf_counter()
+        output = _help._generate_tensor(*args)
+        return output, perf_counter() - start, _help._worker_usage()
+
+    def _generate_tensor(num, file, px_size, features):
+        # Function that generates a tensor of an image.
+        _decode_warnings._start()
+        try:
+            # Handle warnings as exceptions
+            img = Image.open(file)
+            _decode_warnings._raise()
+            if img.getbands() != ('R', 'G', 'B'):
+                img = img.convert('RGB')
+            shape = np.asarray(img).shape # new
+            if features == 'gray':
+                # single channel tensor of the image luminance
+                img = img.convert('L')
+            img = img.resize((px_size, px_size), resample=Image.BICUBIC)
+            img = np.asarray(img)
+            _decode_warnings._raise()
+            # file metadata used for ranking the image quality
+            file_stat = os.stat(file)
+            meta = {'filesize' : file_stat.st_size, 'modified' : file_stat.st_mtime}
+            return (num, img, shape, meta)
+        except Exception as e:
+            print(f"Error {e.__class__.__name__} loading image #{num} : '{file}' -> {e}")
+            if e.__class__.__name__== 'UnidentifiedImageError':
+                return {str(Path(file)) : 'UnidentifiedImageError: file could not be identified as image.'}
+            else:
+                return {str(Path(file)) : str(e)}
+        finally:
+            _decode_warnings._stop()
+
+    def _worker_usage():
+        # Function that returns the process ID and the peak memory usage (RSS) in bytes of the current process
+        if resource is None:
+            return (os.getpid(), None)
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != 'darwin':
+            # ru_maxrss is in kilobytes on Linux
+            peak_rss *= 1024
+        return (os.getpid(), peak_rss)
+
+    def _add_worker_usage(workers, usage):
+        # Function that adds the usage of a worker task to the per-worker stats
+        pid, peak_rss = usage
+        worker = workers.setdefault(str(pid), {'tasks' : 0, 'peak_rss_bytes' : peak_rss})
+        worker['tasks'] += 1
+        if peak_rss is not None:
+            worker['peak_rss_bytes'] = max(worker['peak_rss_bytes'], peak_rss)
+
+    def _profiled(profile, name, function, *args):
+        # Function that runs a function with cProfile, the profile of every process is accumulated until it is written by _write_profile
+        profiler = _profilers.setdefault(name, cProfile.Profile())
+        profiler.enable()
+        try:
+            return function(*args)
+        finally:
+            profiler.disable()
+
+    def _write_profile(profile, name):
+        # Function that writes the accumulated profile of the current process to the 'profile' directory, and removes the profiler
+        if name not in _profilers:
+            return
+        os.makedirs(profile, exist_ok=True)
+        _profilers.pop(name).dump_stats(os.path.join(profile, f'difPy_{name}_{os.getpid()}.prof'))
+
+    def _init_profile(profile, name):
+        # Function that makes a worker process write its profile once, when it exits after the pool is closed
+        # a forked worker process does not continue the profile of its parent process
+        _profilers.pop(name, None)
+        Finalize(None, _help._write_profile, args=(profile, name), exitpriority=0)
+
+    def _pool(executor, processes, maxtasksperchild=None, initializer=None, initargs=()):
+        # Function that returns the pool of workers of an executor, the initializer only runs in worker processes
+        if executor == 'process':
+            return Pool(processes=processes, initializer=initializer, initargs=initargs, maxtasksperchild=maxtasksperchild)
+        elif executor == 'thread':
+            return ThreadPool(processes=processes)
+        else:
+            return _serial_pool()
+
+    async def _run_async(process, *args, callback=None, **kwargs):
+        # Function that runs a difPy process in a thread of the event loop executor, and stops it when the awaiting task is cancelled
+        cancelled = threading.Event()
+        def _callback(event):
+            # the progress callback is called regularly from the thread difPy runs in
+            if cancelled.is_set():
+                raise asyncio.CancelledError()
+            if callback is not None:
+                callback(event)
+        _validate_param._callback(callback)
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(None, partial(process, *args, callback=_callback, **kwargs))
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    def _map_chunksize(n_tasks, processes):
+        # Function that computes the chunksize Pool.map would use for a list of tasks
+        chunksize, extra = divmod(n_tasks, processes * 4)
+        if extra:
+            chunksize += 1
+        return max(chunksize, 1)
+
     def _convert_str_to_int(x):
     # Function to make the CLI accept int and str type inputs for the similarity parameter
         try:
@@ -981,15 +2625,27 @@ if __name__ == '__main__':
     parser.add_argument('-i', '--in_folder', type=lambda x: bool(_help._strtobool(x)), help='Search for matches in the union of directories.', required=False, choices=[True, False], default=False)    
     parser.add_argument('-le', '--limit_extensions', type=lambda x: bool(_help._strtobool(x)), help='Limit search to known image file extensions.', required=False, choices=[True, False], default=True)
     parser.add_argument('-px', '--px_size', type=int, help='Compression size of images in pixels.', required=False, default=50)
+    parser.add_argument('-f', '--features', type=str, help='Color channels the image tensors are generated from.', required=False, choices=['rgb', 'gray'], default='rgb')
     parser.add_argument('-s', '--similarity', type=_help._convert_str_to_int, help='Similarity grade (mse).', required=False, default='duplicates')
     parser.add_argument('-ro', '--rotate', type=lambda x: bool(_help._strtobool(x)), help='Rotate images during comparison process.', required=False, choices=[True, False], default=True)    
     parser.add_argument('-dim', '--same_dim', type=lambda x: bool(_help._strtobool(x)), help='Only compare image having the same dimensions (width x height)', required=False, choices=[True, False], default=True)    
+    parser.add_argument('-at', '--aspect_tolerance', type=float, help='Only compare images whose aspect ratios differ by at most this relative tolerance. Requires -dim False.', required=False, default=None)
     parser.add_argument('-mv', '--move_to', type=str, help='Output directory path of lower quality images among matches.', required=False, default=None)
     parser.add_argument('-d', '--delete', type=lambda x: bool(_help._strtobool(x)), help='Delete lower quality images among matches.', required=False, choices=[True, False], default=False)
     parser.add_argument('-sd', '--silent_del', type=lambda x: bool(_help._strtobool(x)), help='Suppress the user confirmation when deleting images.', required=False, choices=[True, False], default=False)
     parser.add_argument('-p', '--show_progress', type=lambda x: bool(_help._strtobool(x)), help='Show the real-time progress of difPy.', required=False, choices=[True, False], default=True)
     parser.add_argument('-proc', '--processes', type=_help._convert_str_to_int, help=' Number of worker processes for multiprocessing.', required=False, default=os.cpu_count())
     parser.add_argument('-ch', '--chunksize', type=_help._convert_str_to_int, help='Only relevant when dataset > 5k images. Sets the batch size at which the job is simultaneously processed when multiprocessing.', required=False, default=None)
+    parser.add_argument('-ag', '--against', type=str, nargs='+', help='Paths of the directories to search the input directories against. Default is None.', required=False, default=None)
+    parser.add_argument('-rb', '--rank_by', type=str, help='Policy by which the highest quality image among matches is selected.', required=False, choices=['resolution', 'filesize', 'newest', 'oldest'], default='resolution')
+    parser.add_argument('-hl', '--hardlink', type=lambda x: bool(_help._strtobool(x)), help='Replace lower quality images among matches by hardlinks instead of deleting them.', required=False, choices=[True, False], default=False)
+    parser.add_argument('-j', '--journal', type=str, help='Path of the journal file that moved/deleted files are recorded to. Rerun with the same journal to resume.', required=False, default=None)
+    parser.add_argument('-dt', '--decode_timeout', type=float, help='Number of seconds after which the decoding of an image is aborted.', required=False, default=None)
+    parser.add_argument('-mtc', '--maxtasksperchild', type=int, help='Number of images a worker process decodes before it is replaced.', required=False, default=None)
+    parser.add_argument('-ex', '--executor', type=str, help='Executor the images are decoded and compared with.', required=False, choices=['auto', 'process', 'thread', 'serial'], default='auto')
+    parser.add_argument('-of', '--output_format', type=str, help='Format of the difPy result files.', required=False, choices=['json', 'jsonl', 'csv', 'npz'], default='json')
+    parser.add_argument('-gz', '--compress', type=lambda x: bool(_help._strtobool(x)), help='Compress the difPy result files with gzip.', required=False, choices=[True, False], default=False)
+    parser.add_argument('-prof', '--profile', type=str, help='Output directory path for the cProfile profiles of the search workers.', required=False, default=None)
     parser.add_argument('-la', '--lazy', type=lambda x: bool(_help._strtobool(x)), help='(Deprecated) Only compare image having the same dimensions (width x height).', required=False, choices=[True, False], default=None)    
 
     args = parser.parse_args()
@@ -1011,33 +2667,26 @@ if __name__ == '__main__':
         raise Exception(f'"move_to" and "delete" parameter are mutually exclusive. Please select one of them.')
 
     # run difPy
-    dif = build(args.directory, recursive=args.recursive, in_folder=args.in_folder, limit_extensions=args.limit_extensions, px_size=args.px_size, show_progress=args.show_progress, processes=args.processes, )
-    se = search(dif, similarity=args.similarity, rotate=args.rotate, same_dim=args.same_dim, processes=args.processes, chunksize=args.chunksize)
+    dif = build(args.directory, recursive=args.recursive, in_folder=args.in_folder, limit_extensions=args.limit_extensions, px_size=args.px_size, features=args.features, show_progress=args.show_progress, processes=args.processes, decode_timeout=args.decode_timeout, maxtasksperchild=args.maxtasksperchild, executor=args.executor)
+    if args.against != None:
+        against = build(args.against, recursive=args.recursive, limit_extensions=args.limit_extensions, px_size=args.px_size, features=args.features, show_progress=args.show_progress, processes=args.processes, decode_timeout=args.decode_timeout, maxtasksperchild=args.maxtasksperchild, executor=args.executor)
+    else:
+        against = None
+    se = search(dif, similarity=args.similarity, rotate=args.rotate, same_dim=args.same_dim, aspect_tolerance=args.aspect_tolerance, processes=args.processes, chunksize=args.chunksize, against=against, rank_by=args.rank_by, profile=args.profile, executor=args.executor)
 
-    # create filenames for the output files
+    # output 'search.results', 'search.lower_quality' and 'search.stats' to files
     timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    result_file = f'difPy_{timestamp}_results.json'
-    lq_file = f'difPy_{timestamp}_lower_quality.txt'
-    stats_file = f'difPy_{timestamp}_stats.json'
-
-    # output 'search.results' to file
-    with open(os.path.join(dir, result_file), 'w') as file:
-        json.dump(se.result, file)
-    # output 'search.stats' to file
-    with open(os.path.join(dir, stats_file), 'w') as file:
-        json.dump(se.stats, file)
-    # output 'search.lower_quality' to file
-    with open(os.path.join(dir, lq_file), 'w') as file:
-        file.write(f"{se.lower_quality}")
+    output_files = _output._write(se, dir, timestamp, output_format=args.output_format, compress=args.compress)
 
     # check 'move_to' parameter
     if args.move_to != None:
         # move lower quality files
-        se.move_to(args.move_to)
+        se.move_to(args.move_to, journal=args.journal)
 
     # check 'delete' parameter
     if args.delete:
         # delete search.lower_quality files
-        se.delete(silent_del=args.silent_del)
+        se.delete(silent_del=args.silent_del, hardlink=args.hardlink, journal=args.journal)
 
-    print(f'''\n{result_file}\n{lq_file}\n{stats_file}\n\nsaved in '{dir}'.''')
\ No newline at end of file
+    output_files = '\n'.join(output_files)
+    print(f'''\n{output_files}\n\nsaved in '{dir}'.''')
\ No newline at end of file
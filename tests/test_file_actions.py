@@ -0,0 +1,144 @@
+'''
+Tests of the file actions of difPy.search: move_to, delete, hardlink, undo and the resumable journal.
+'''
+import json
+import os
+import numpy as np
+import pytest
+from PIL import Image
+import difPy
+
+def _save(path, value, size):
+    # Function that saves a solid gray image
+    Image.fromarray(np.full((size, size, 3), value, dtype=np.uint8)).save(path)
+    return str(path)
+
+@pytest.fixture
+def duplicates(tmp_path):
+    # two groups of exact duplicates, the larger image of each group is the one that is kept
+    images = tmp_path / 'images'
+    images.mkdir()
+    files = {
+        'keep_1' : _save(images / 'a.png', 50, 64),
+        'lower_1' : _save(images / 'b.png', 50, 32),
+        'keep_2' : _save(images / 'c.png', 200, 64),
+        'lower_2' : _save(images / 'd.png', 200, 32),
+    }
+    return tmp_path, files
+
+def _search(directory, **kwargs):
+    dif = difPy.build(directory, show_progress=False, processes=1)
+    return difPy.search(dif, show_progress=False, processes=1, same_dim=False, **kwargs)
+
+def test_move_to_and_undo(duplicates):
+    tmp_path, files = duplicates
+    se = _search(str(tmp_path / 'images'))
+    assert sorted(se.lower_quality) == sorted([files['lower_1'], files['lower_2']])
+
+    destination = tmp_path / 'moved'
+    journal = str(tmp_path / 'journal.jsonl')
+    se.move_to(str(destination), journal=journal)
+    assert sorted(os.listdir(destination)) == ['b.png', 'd.png']
+    assert not os.path.exists(files['lower_1']) and not os.path.exists(files['lower_2'])
+    assert sorted(se.lower_quality) == sorted([str(destination / 'b.png'), str(destination / 'd.png')])
+
+    se.undo(journal)
+    assert os.path.exists(files['lower_1']) and os.path.exists(files['lower_2'])
+    assert os.listdir(destination) == []
+    assert sorted(se.lower_quality) == sorted([files['lower_1'], files['lower_2']])
+
+def test_delete(duplicates):
+    tmp_path, files = duplicates
+    se = _search(str(tmp_path / 'images'))
+    se.delete(silent_del=True)
+    assert sorted(os.listdir(tmp_path / 'images')) == ['a.png', 'c.png']
+
+def test_hardlink_and_undo(duplicates):
+    tmp_path, files = duplicates
+    se = _search(str(tmp_path / 'images'))
+    journal = str(tmp_path / 'journal.jsonl')
+    se.delete(silent_del=True, hardlink=True, journal=journal)
+    assert os.path.samefile(files['lower_1'], files['keep_1'])
+    assert os.path.samefile(files['lower_2'], files['keep_2'])
+
+    se.undo(journal)
+    assert not os.path.samefile(files['lower_1'], files['keep_1'])
+    assert not os.path.samefile(files['lower_2'], files['keep_2'])
+    with Image.open(files['lower_1']) as img:
+        # the restored file is an independent copy of the kept image
+        assert img.size == (64, 64)
+
+def test_hardlink_chain(tmp_path):
+    # a -> b matches in one group and b -> c in another, c is the highest quality image
+    images = tmp_path / 'images'
+    images.mkdir()
+    a = _save(images / 'a.png', 100, 32)
+    b = _save(images / 'b.png', 103, 48)
+    c = _save(images / 'c.png', 106, 64)
+    # the files are passed in this order, so that (a, b) is grouped before (b, c)
+    se = _search([a, b, c], similarity=20, rotate=False)
+    assert se.result == {a : [[b, 9.0]], b : [[c, 9.0]]}
+    assert sorted(se.lower_quality) == sorted([a, b])
+
+    journal = str(tmp_path / 'journal.jsonl')
+    se.delete(silent_del=True, hardlink=True, journal=journal)
+    assert os.path.samefile(a, c)
+    assert os.path.samefile(b, c)
+    # both images are linked to c directly, independent of the order the links were created in
+    with open(journal) as file:
+        assert sorted([(entry['src'], entry['dst']) for entry in map(json.loads, file)]) == [(a, c), (b, c)]
+
+def test_resume_interrupted_journal(duplicates):
+    tmp_path, files = duplicates
+    se = _search(str(tmp_path / 'images'))
+    destination = tmp_path / 'moved'
+    destination.mkdir()
+    journal = str(tmp_path / 'journal.jsonl')
+
+    # interrupted run: the first file was moved and journaled, the second one moved but not journaled,
+    # and the journal ends with a partially written line
+    first, second = sorted(se.lower_quality)
+    os.replace(first, destination / os.path.basename(first))
+    os.replace(second, destination / os.path.basename(second))
+    with open(journal, 'w') as file:
+        file.write(json.dumps({'action' : 'move', 'src' : first, 'dst' : str(destination / os.path.basename(first))}) + '\n')
+        file.write('{"action" : "move", "src" : ')
+
+    se.move_to(str(destination), journal=journal)
+    assert sorted(os.listdir(destination)) == ['b.png', 'd.png']
+    assert sorted(os.listdir(tmp_path / 'images')) == ['a.png', 'c.png']
+
+    se.undo(journal)
+    assert sorted(os.listdir(tmp_path / 'images')) == ['a.png', 'b.png', 'c.png', 'd.png']
+
+def test_move_to_same_names(tmp_path):
+    # lower quality images with the same name in different folders are moved to distinct files
+    images = tmp_path / 'images'
+    for folder in ['d1', 'd2']:
+        (images / folder).mkdir(parents=True)
+        _save(images / folder / 'keep.png', 50 if folder == 'd1' else 200, 64)
+        _save(images / folder / 'x.png', 50 if folder == 'd1' else 200, 32)
+    se = _search(str(images))
+    destination = tmp_path / 'moved'
+    journal = str(tmp_path / 'journal.jsonl')
+    se.move_to(str(destination), journal=journal)
+    assert sorted(os.listdir(destination)) == ['x.png', 'x_1.png']
+    with open(journal) as file:
+        assert len(set([json.loads(line)['dst'] for line in file])) == 2
+
+    se.undo(journal)
+    assert os.listdir(destination) == []
+    with Image.open(images / 'd2' / 'x.png') as img:
+        assert img.getpixel((0, 0)) == (200, 200, 200)
+
+def test_move_to_does_not_overwrite(duplicates):
+    tmp_path, files = duplicates
+    se = _search(str(tmp_path / 'images'))
+    destination = tmp_path / 'moved'
+    destination.mkdir()
+    existing = _save(destination / 'b.png', 0, 8)
+    with pytest.warns(UserWarning, match='already exists'):
+        se.move_to(str(destination))
+    assert os.path.exists(files['lower_1'])
+    with Image.open(existing) as img:
+        assert img.size == (8, 8)
@@ -0,0 +1,78 @@
+'''
+Tests of the search of difPy.search and difPy.query.
+'''
+import numpy as np
+import pytest
+from PIL import Image
+import difPy
+
+def _save(path, array):
+    # Function that saves an image array
+    Image.fromarray(array).save(path)
+    return str(path)
+
+@pytest.fixture
+def repositories(tmp_path):
+    # an archive with two copies of an image and one large image, and incoming copies of them
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 255, (64, 64, 3), dtype=np.uint8)
+    big = rng.integers(0, 255, (128, 128, 3), dtype=np.uint8)
+    (tmp_path / 'archive').mkdir()
+    (tmp_path / 'incoming').mkdir()
+    files = {
+        'archive' : _save(tmp_path / 'archive' / 'a.png', image),
+        'archive_copy' : _save(tmp_path / 'archive' / 'b.png', image),
+        'archive_big' : _save(tmp_path / 'archive' / 'big.png', big),
+        'incoming_1' : _save(tmp_path / 'incoming' / 'u1.png', image),
+        'incoming_2' : _save(tmp_path / 'incoming' / 'u2.png', image),
+    }
+    return tmp_path, files
+
+def _build(*directory):
+    return difPy.build(*directory, show_progress=False, processes=1)
+
+def test_query_lists_all_matches_of_every_incoming_image(repositories):
+    tmp_path, files = repositories
+    se = difPy.query(_build(str(tmp_path / 'archive')), _build(str(tmp_path / 'incoming')), show_progress=False, processes=1)
+    assert {img : sorted(match for match, mse in matches) for img, matches in se.result.items()} == {
+        files['incoming_1'] : sorted([files['archive'], files['archive_copy']]),
+        files['incoming_2'] : sorted([files['archive'], files['archive_copy']]),
+    }
+    # only incoming images are lower quality, the archive is never changed
+    assert sorted(se.lower_quality) == sorted([files['incoming_1'], files['incoming_2']])
+
+def test_query_does_not_match_a_file_with_itself(repositories):
+    tmp_path, files = repositories
+    se = difPy.query(_build(str(tmp_path / 'archive')), _build(files['archive_big']), show_progress=False, processes=1)
+    assert se.result == {}
+    assert se.lower_quality == []
+
+@pytest.fixture
+def rotated(tmp_path):
+    # copies of images and rotated variants in interleaved order, so that identical images are not adjacent and the
+    # MSE of a pair depends on which image is rotated
+    rng = np.random.default_rng(1)
+    bases = [rng.integers(0, 255, (10, 10, 3), dtype=np.uint8) for i in range(3)]
+    arrays = []
+    for i, base in enumerate(bases):
+        arrays += [base, np.rot90(base, k=3), base, np.rot90(base, k=1)]
+    order = rng.permutation(len(arrays))
+    return [_save(tmp_path / f'{position:02d}.png', arrays[i]) for position, i in enumerate(order)]
+
+def test_collapsed_search_matches_uncollapsed(rotated, monkeypatch):
+    # the comparison of the first image of every group of identical images, the reverse comparisons and the expansion of
+    # the matches give the same raw result as comparing every pair of images
+    dif = difPy.build(rotated, show_progress=False, processes=1, px_size=10)
+    kwargs = dict(similarity=10**9, show_progress=False, processes=1)
+    events = []
+    collapsed = difPy.search(dif, callback=events.append, **kwargs)
+    assert collapsed.stats['process']['search']['performance']['identical_images'] == 3
+    n_pairs = len(rotated)*(len(rotated)-1)//2
+    final = [event for event in events if event['stage'] == 'search'][-1]
+    assert (final['done'], final['pairs_compared'], final['matches_found']) == (n_pairs, n_pairs, n_pairs)
+
+    monkeypatch.setattr(difPy.dif.search, '_collapse_ids', lambda self, ids, difpy_obj: {img_id : [img_id] for img_id in ids})
+    uncollapsed = difPy.search(dif, **kwargs)
+    assert uncollapsed.stats['process']['search']['performance']['identical_images'] == 0
+    assert collapsed.result == uncollapsed.result
+    assert sorted(collapsed.lower_quality) == sorted(uncollapsed.lower_quality)